@@ -1,18 +1,40 @@
 import sys
+import asyncio
+import base64
+import copy
+import csv
+import dataclasses
+import difflib
+import gc
+import gzip
+import hashlib
+import json
+import selectors
+import socket
+import sqlite3
+import subprocess
 import pyaudio
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                             QHBoxLayout, QComboBox, QPushButton, QLabel,
                             QFrame, QGraphicsDropShadowEffect, QProgressBar,
                             QDoubleSpinBox, QCheckBox, QGroupBox, QSpinBox,
-                            QColorDialog, QMessageBox)
-from PyQt6.QtCore import Qt, QThread, pyqtSignal, QSize, QPoint, QTimer
-from PyQt6.QtGui import QColor
+                            QColorDialog, QMessageBox, QListWidget, QListWidgetItem,
+                            QFileDialog, QListView, QLineEdit)
+from PyQt6.QtCore import (Qt, QThread, pyqtSignal, QSize, QPoint, QTimer,
+                          QAbstractListModel, QModelIndex, QCoreApplication)
+from PyQt6.QtGui import QColor, QFont, QFontMetricsF
 from RealtimeSTT import AudioToTextRecorder
+from RealtimeSTT.transcription_engines import (create_transcription_engine,
+                                               TranscriptionEngineConfig)
+import os
 import re
+import httpx
 import ollama
 import time
-from queue import Queue, Empty
-from threading import Thread
+from collections import deque
+from concurrent.futures import Future
+from queue import Empty
+from threading import Thread, Condition, Event, Lock
 
 class StyleHelper:
     # 磨砂质感配色
@@ -21,6 +43,8 @@ class StyleHelper:
     ACCENT = "#7C76F2"
     TEXT = "#FFFFFF"
     SUBTEXT = "rgba(255, 255, 255, 0.7)"
+    # 多音源字幕轨道颜色（按轨道序号循环使用）
+    TRACK_COLORS = ["#FFFFFF", "#FFD966", "#8FE3FF", "#B8F28C", "#FF9ECF"]
     
     @staticmethod
     def get_button_style(primary=False):
@@ -167,6 +191,76 @@ class GlassCard(QFrame):
         shadow.setOffset(0, 8)
         self.setGraphicsEffect(shadow)
 
+class LineBreaker:
+    """按像素宽度给字幕断行（用 QFontMetricsF 测量，字宽按字体缓存）
+
+    中日文字之间可以任意断行，但避头尾标点不能出现在行首/行尾；
+    拉丁文字只在空格处断行，单词超过一行宽时按字符断开。
+    """
+    NO_LINE_START = set("，。、！？；：,.!?;:)）」』》〉】〕…‥ー～・%％")
+    NO_LINE_END = set("(（「『《〈【〔")
+    width_caches = {}  # font.key() -> {字符: 宽度}，同一字体的实例共享
+
+    def __init__(self, font):
+        self.metrics = QFontMetricsF(font)
+        self.widths = self.width_caches.setdefault(font.key(), {})
+
+    def char_width(self, char):
+        width = self.widths.get(char)
+        if width is None:
+            width = self.widths[char] = self.metrics.horizontalAdvance(char)
+        return width
+
+    @staticmethod
+    def is_cjk(char):
+        return '\u2e80' <= char <= '\u9fff' or '\uf900' <= char <= '\ufaff' or '\uff00' <= char <= '\uffef'
+
+    def can_break(self, text, i):
+        """text[i] 之前能否断行"""
+        prev, char = text[i - 1], text[i]
+        if char.isspace() or char in self.NO_LINE_START or prev in self.NO_LINE_END:
+            return False
+        return prev.isspace() or self.is_cjk(prev) or self.is_cjk(char)
+
+    def wrap(self, text, max_width, start=0):
+        """贪心断行，返回从 start 开始的各行起始位置（行尾空格不占宽度）"""
+        starts = [start]
+        width = 0.0
+        break_at, width_at_break = None, 0.0
+        for i in range(start, len(text)):
+            char = text[i]
+            if i > starts[-1] and self.can_break(text, i):
+                break_at, width_at_break = i, width
+            char_width = self.char_width(char)
+            if width + char_width > max_width and i > starts[-1] and not char.isspace():
+                if break_at is not None:
+                    starts.append(break_at)
+                    width -= width_at_break
+                else:
+                    starts.append(i)  # 没有断行点（超长单词）时按字符断开
+                    width = 0.0
+                break_at = None
+            width += char_width
+        return starts
+
+    def layout(self, text, max_width, previous=None):
+        """断行，返回 (text, max_width, 行起始位置)
+
+        previous 是上一次的返回值。实时转录的文本通常只在末尾增长，
+        只是追加且宽度没变时前面的行不会变，只重排最后一行；
+        文本被修改（识别结果回改）时完整重排，否则旧的断行点可能不再成立。
+        """
+        if previous:
+            old_text, old_width, old_starts = previous
+            if old_width == max_width and text.startswith(old_text):
+                return text, max_width, old_starts[:-1] + self.wrap(text, max_width, old_starts[-1])
+        return text, max_width, self.wrap(text, max_width)
+
+    @staticmethod
+    def lines(state):
+        text, _, starts = state
+        return [text[a:b].strip() for a, b in zip(starts, starts[1:] + [len(text)])]
+
 class SubtitleWindow(QWidget):
     def __init__(self):
         super().__init__()
@@ -186,23 +280,11 @@ class SubtitleWindow(QWidget):
         self.card_layout = QVBoxLayout(self.card)
         self.card_layout.setContentsMargins(0, 0, 0, 0)  # Remove card layout margins
         
-        # 创建文本标签
-        self.label = QLabel()
-        self.label.setStyleSheet("""
-            QLabel {
-                color: white;
-                font-size: 28px;
-                padding: 0;
-                background-color: transparent;
-                border: none;
-                qproperty-wordWrap: true;
-            }
-        """)
-        self.label.setWordWrap(True)  # 允许文字换行
-        self.label.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        self.label.setMinimumHeight(80)  # 设置最小高度
-        self.label.setMaximumHeight(150)  # 设置最大高度限制两行
-        self.card_layout.addWidget(self.label)
+        # 创建文本标签（每个音源一条字幕轨道，默认只有一条）
+        self.track_labels = []
+        self.font_size = 28
+        self.border_css = "border: none;"
+        self.set_tracks(["默认"])
         
         # 添加调整大小的控件
         self.resize_handle = QWidget(self)
@@ -308,29 +390,64 @@ class SubtitleWindow(QWidget):
         
         self.layout.addWidget(self.card)
         self.setLayout(self.layout)
+        self.reset_line_breaker()
         
         # 拖动相关
         self.dragging = False
         self.resizing = False
         self.offset = None
         
-    def process_text(self, text):
-        """处理文本以限制显示行数"""
-        # 按句号或问号分割文本
-        sentences = re.split('[。.？?!！]', text)
-        # 过滤掉空字符串
-        sentences = [s.strip() for s in sentences if s.strip()]
-        
-        if len(sentences) > 0:
-            # 如果只有一个句子，直接显示
-            if len(sentences) == 1:
-                return sentences[0]
-            # 如果有多个句子，只显示最后两个
-            else:
-                return '\n'.join(sentences[-2:])
+    def process_text(self, text, track=0):
+        """按标签宽度断行，只显示最后两行（文本增长时前面的行保持不动，向上滚动）"""
+        label = self.track_labels[track]
+        max_width = max(1, label.width() - 2 * self.border_width_spin.value() - 4)
+        state = self.line_layouts.get(track)
+        state = self.line_breaker.layout(text, max_width, state)
+        self.line_layouts[track] = state
+        lines = [line for line in LineBreaker.lines(state) if line]
+        return '\n'.join(lines[-2:])
 
-    def update_text(self, text):
-        self.label.setText(self.process_text(text))
+    def reset_line_breaker(self):
+        """字体或宽度变化后重新测量"""
+        font = QFont(self.track_labels[0].font() if self.track_labels else self.font())
+        font.setPixelSize(self.font_size)
+        self.line_breaker = LineBreaker(font)
+        self.line_layouts = {}
+
+    def create_track_label(self, index):
+        """创建一条字幕轨道的标签，不同轨道使用不同颜色"""
+        color = StyleHelper.TRACK_COLORS[index % len(StyleHelper.TRACK_COLORS)]
+        label = QLabel()
+        label.setStyleSheet(f"""
+            QLabel {{
+                color: {color};
+                font-size: {self.font_size}px;
+                padding: 0;
+                background-color: transparent;
+                {self.border_css}
+            }}
+        """)
+        label.setWordWrap(False)  # 由 LineBreaker 断行，Qt 不再每次重新计算换行
+        label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        label.setMinimumHeight(80)  # 设置最小高度
+        label.setMaximumHeight(150)  # 设置最大高度限制两行
+        return label
+
+    def set_tracks(self, names):
+        """按音源重建字幕轨道"""
+        for label in self.track_labels:
+            self.card_layout.removeWidget(label)
+            label.deleteLater()
+        self.track_names = list(names)
+        self.track_labels = [self.create_track_label(i) for i in range(len(names))]
+        for label in self.track_labels:
+            self.card_layout.addWidget(label)
+        self.label = self.track_labels[0]
+        self.line_layouts = {}
+
+    def update_text(self, text, track=0):
+        if 0 <= track < len(self.track_labels):
+            self.track_labels[track].setText(self.process_text(text, track))
 
     def show_settings(self):
         if self.settings_panel.isHidden():
@@ -342,9 +459,12 @@ class SubtitleWindow(QWidget):
             self.settings_panel.hide()
 
     def update_font_size(self, size):
-        style = self.label.styleSheet()
-        style = re.sub(r'font-size:\s*\d+px;', f'font-size: {size}px;', style)
-        self.label.setStyleSheet(style)
+        self.font_size = size
+        for label in self.track_labels:
+            style = label.styleSheet()
+            style = re.sub(r'font-size:\s*\d+px;', f'font-size: {size}px;', style)
+            label.setStyleSheet(style)
+        self.reset_line_breaker()
 
     def choose_border_color(self):
         color = QColorDialog.getColor(self.current_border_color, self, "选择边框颜色", 
@@ -367,11 +487,13 @@ class SubtitleWindow(QWidget):
         self.update_border_style()
 
     def update_border_style(self):
-        style = self.label.styleSheet()
         border_color = self.current_border_color.name(QColor.NameFormat.HexArgb)
         border_width = self.border_width_spin.value()
-        style = re.sub(r'border:.*?;', f'border: {border_width}px solid {border_color};', style)
-        self.label.setStyleSheet(style)
+        self.border_css = f'border: {border_width}px solid {border_color};'
+        for label in self.track_labels:
+            style = label.styleSheet()
+            style = re.sub(r'border:.*?;', self.border_css, style)
+            label.setStyleSheet(style)
 
     def update_opacity(self, value):
         self.setWindowOpacity(value)
@@ -386,168 +508,2529 @@ class SubtitleWindow(QWidget):
             new_pos = event.globalPosition().toPoint() - self.offset
             self.move(new_pos)
 
-    def mouseReleaseEvent(self, event):
-        if event.button() == Qt.MouseButton.LeftButton:
-            self.dragging = False
-            self.offset = None
+    def mouseReleaseEvent(self, event):
+        if event.button() == Qt.MouseButton.LeftButton:
+            self.dragging = False
+            self.offset = None
+
+    def start_resize(self, event):
+        if event.button() == Qt.MouseButton.LeftButton:
+            self.resizing = True
+            self.resize_start_pos = event.globalPosition().toPoint()
+            self.resize_start_size = self.size()
+
+    def do_resize(self, event):
+        if self.resizing:
+            diff = event.globalPosition().toPoint() - self.resize_start_pos
+            new_size = QSize(
+                self.resize_start_size.width() + diff.x(),
+                self.resize_start_size.height() + diff.y()
+            )
+            self.resize(new_size)
+
+    def mouseReleaseEvent(self, event):
+        if event.button() == Qt.MouseButton.LeftButton:
+            self.dragging = False
+            self.resizing = False
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        # 更新调整大小控件的位置
+        self.resize_handle.move(
+            self.width() - self.resize_handle.width() - 5,
+            self.height() - self.resize_handle.height() - 5
+        )
+        # 更新设置按钮的位置
+        self.settings_button.move(5, 5)
+        self.line_layouts = {}  # 宽度变了，下次更新时重新断行
+
+# 各级队列的容量与满载策略，可按需调整
+#   drop_oldest: 队列满时丢弃最旧的一项（pinned 的项不会被丢弃，见 BoundedQueue.put）
+#   keep_latest: 同一 key（如同一字幕轨道）只保留最新一项，仍然满时丢弃最旧的一项
+#   block:       队列满时等待 block_timeout 秒，仍然没有空位则丢弃新数据
+QUEUE_POLICIES = {
+    'inference': {'maxsize': 4, 'policy': 'drop_oldest'},
+    'translate': {'maxsize': 8, 'policy': 'keep_latest'},
+    'stt_ui': {'maxsize': 1, 'policy': 'keep_latest'},
+    'translation_ui': {'maxsize': 1, 'policy': 'keep_latest'},
+    # 识别后端交给识别线程的最终转录：不能丢，后端线程等识别线程取走
+    'stt_final': {'maxsize': 8, 'policy': 'block', 'block_timeout': 5.0},
+    # 等待最终转录的句子音频：全部 pinned 不丢弃，按说话顺序逐句转录
+    'stt_utterance': {'maxsize': 8, 'policy': 'drop_oldest'},
+    # 历史记录的写入：全部 pinned 不丢弃，数据库跟不上时超出 maxsize 的部分暂存在内存里
+    'store': {'maxsize': 10000, 'policy': 'drop_oldest'},
+}
+
+class BoundedQueue:
+    """有界队列，满载时按策略丢弃数据，并统计深度和丢弃数量"""
+
+    POLICIES = ('drop_oldest', 'keep_latest', 'block')
+
+    def __init__(self, maxsize, policy='drop_oldest', name='', block_timeout=0.05):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown queue policy: {policy}")
+        self.maxsize = max(1, maxsize)
+        self.policy = policy
+        self.name = name
+        self.block_timeout = block_timeout
+        self.items = deque()  # (key, item, pinned)
+        self.cond = Condition()
+        self.dropped = 0
+        self.high_water = 0
+        self.pinned = 0  # 队列中不可丢弃的项数
+
+    @classmethod
+    def for_stage(cls, stage):
+        """按 QUEUE_POLICIES 中的配置创建某一级的队列"""
+        return cls(name=stage, **QUEUE_POLICIES[stage])
+
+    def put(self, item, key=None, pinned=False):
+        """放入一项，返回是否被接收
+
+        pinned 的项（如最终转录）不会因为满载被丢弃，满载时只丢弃普通项；
+        队列里全是 pinned 项时照样接收，此时深度可以超过 maxsize。
+        """
+        with self.cond:
+            if self.policy == 'keep_latest':
+                for i, (k, _, p) in enumerate(self.items):
+                    if k == key and not p:
+                        del self.items[i]
+                        self.dropped += 1
+                        break
+            if len(self.items) >= self.maxsize and self.pinned < len(self.items):
+                if self.policy == 'block':
+                    deadline = time.time() + self.block_timeout
+                    while len(self.items) >= self.maxsize:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            self.dropped += 1
+                            return False
+                        self.cond.wait(remaining)
+                else:
+                    oldest = next(i for i, (_, _, p) in enumerate(self.items) if not p)
+                    del self.items[oldest]
+                    self.dropped += 1
+            self.items.append((key, item, pinned))
+            self.pinned += pinned
+            self.high_water = max(self.high_water, len(self.items))
+            self.cond.notify_all()
+            return True
+
+    def get(self, timeout=None):
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.items, timeout):
+                raise Empty
+            _, item, pinned = self.items.popleft()
+            self.pinned -= pinned
+            self.cond.notify_all()
+            return item
+
+    def get_nowait(self):
+        return self.get(timeout=0)
+
+    def clear(self):
+        with self.cond:
+            self.items.clear()
+            self.pinned = 0
+            self.cond.notify_all()
+
+    def pinned_items(self):
+        """队列中 pinned 的项（不取出），用于把未处理的数据交给替换它的线程"""
+        with self.cond:
+            return [item for _, item, pinned in self.items if pinned]
+
+    def qsize(self):
+        return len(self.items)
+
+    def stats(self):
+        return {
+            'name': self.name,
+            'policy': self.policy,
+            'depth': len(self.items),
+            'maxsize': self.maxsize,
+            'high_water': self.high_water,
+            'dropped': self.dropped,
+            'pinned': self.pinned,
+        }
+
+def resolve_device(device):
+    """没有可用的 CUDA 时退回 CPU（与 RealtimeSTT 的行为一致）"""
+    if device == "cuda":
+        try:
+            import torch
+            if not torch.cuda.is_available():
+                return "cpu"
+        except ImportError:
+            return "cpu"
+    return device
+
+def resident_memory_mb():
+    """当前进程的常驻内存（MB），无法获取时返回 None"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    except ImportError:
+        return None
+
+class ModelRegistry:
+    """进程内共享的 Whisper 模型注册表
+
+    相同 (模型, 设备, 精度) 的模型只加载一次并按引用计数释放，
+    所以主模型 / 实时模型配置相同、多个音源同时使用时都不会重复占用内存。
+    引用计数归零（卸载模型）时立即释放，重新加载会重新读取模型文件。
+    加载（可能要下载模型）在锁外进行，同一模型的其他调用者等待同一个 Future，
+    stats() 只读快照，界面定时器不会被加载卡住。
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.entries = {}  # key -> {'future', 'refs', 'memory_mb'}，future 完成前表示正在加载
+
+    @staticmethod
+    def resolve_compute_type(device, compute_type):
+        """自动精度：CPU 上使用 int8 量化权重，GPU 上使用模型默认精度"""
+        if compute_type in (None, '', 'auto'):
+            return 'int8' if device == 'cpu' else 'default'
+        return compute_type
+
+    def acquire(self, model, device, compute_type='auto'):
+        """获取（必要时加载）模型，返回 (key, engine)，用完后调用 release(key)"""
+        device = resolve_device(device)
+        key = (model, device, self.resolve_compute_type(device, compute_type))
+        with self.lock:
+            entry = self.entries.get(key)
+            loader = entry is None
+            if loader:
+                entry = self.entries[key] = {'future': Future(), 'refs': 0, 'memory_mb': None}
+            entry['refs'] += 1
+        if loader:
+            try:
+                before = resident_memory_mb()
+                engine = create_transcription_engine("faster_whisper", TranscriptionEngineConfig(
+                    model=model,
+                    device=key[1],
+                    compute_type=key[2],
+                    suppress_tokens=[-1],
+                ))
+                after = resident_memory_mb()
+                entry['memory_mb'] = after - before if before is not None and after is not None else None
+                entry['future'].set_result(engine)
+            except Exception as e:
+                with self.lock:
+                    if self.entries.get(key) is entry:
+                        del self.entries[key]
+                entry['future'].set_exception(e)
+        # 加载失败时条目已被移除，不需要 release
+        return key, entry['future'].result()
+
+    def release(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return
+            entry['refs'] -= 1
+            if entry['refs'] <= 0:
+                del self.entries[key]
+                gc.collect()
+
+    def stats(self):
+        with self.lock:
+            return [{'model': key[0], 'device': key[1], 'compute_type': key[2],
+                     'refs': entry['refs'], 'memory_mb': entry['memory_mb'],
+                     'loading': not entry['future'].done()}
+                    for key, entry in self.entries.items()]
+
+MODEL_REGISTRY = ModelRegistry()
+
+class LanguageTracker:
+    """单个音源的会话语言（自动检测模式）
+
+    每句话只对开头几秒做语言识别。语言确定后保持不变，只有连续多次
+    高置信度地检测到另一种语言时才切换，避免个别短句误判来回跳。
+    """
+
+    def __init__(self, min_confidence=0.5, switch_confidence=0.8, switch_votes=2):
+        self.min_confidence = min_confidence
+        self.switch_confidence = switch_confidence
+        self.switch_votes = switch_votes
+        self.language = None
+        self.probability = 0.0
+        self.candidate = None
+        self.votes = 0
+        self.lock = Lock()
+
+    def observe(self, language, probability):
+        """记录一次检测结果，返回当前会话语言"""
+        with self.lock:
+            if not language:
+                return self.language
+            if self.language is None:
+                if probability >= self.min_confidence:
+                    self.language, self.probability = language, probability
+            elif language == self.language:
+                self.probability = probability
+                self.candidate, self.votes = None, 0
+            elif probability >= self.switch_confidence:
+                self.votes = self.votes + 1 if language == self.candidate else 1
+                self.candidate = language
+                if self.votes >= self.switch_votes:
+                    self.language, self.probability = language, probability
+                    self.candidate, self.votes = None, 0
+            return self.language
+
+class SharedInferencePool:
+    """多个音源共享的转录推理池
+
+    模型从 ModelRegistry 获取（只加载一次），所有音源的转录请求按音源轮询调度到
+    固定数量的工作线程，避免某个说话频繁的音源占满推理资源。
+    """
+
+    SAMPLE_RATE = 16000
+    LANGUAGE_ID_SECONDS = 3.0  # 自动检测语言时只看每句话开头这么长的音频
+
+    def __init__(self, model, realtime_model, device="cuda", compute_type="auto", workers=2,
+                 registry=None, auto_language=False):
+        self.model = model
+        self.realtime_model = realtime_model
+        self.device = resolve_device(device)
+        self.compute_type = compute_type
+        self.registry = registry or MODEL_REGISTRY
+        self.engines = {}
+        self.model_keys = []
+        self.auto_language = auto_language
+        self.languages = {}  # source_id -> LanguageTracker
+
+        self.pending = {}  # source_id -> deque[(role, args, kwargs, future)]
+        self.max_pending = QUEUE_POLICIES['inference']['maxsize']  # 每个音源最多排队的请求数
+        self.dropped = 0
+        self.order = deque()  # 等待调度的音源（轮询顺序）
+        self.cond = Condition()
+        self.running = True
+        self.workers = [Thread(target=self.worker_loop, daemon=True) for _ in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def load(self):
+        """加载模型（在识别线程中调用，多个音源只会加载一次）"""
+        with self.cond:
+            if self.engines or not self.running:
+                return
+            # 主模型和实时模型配置相同时注册表返回同一份权重
+            self.engines['main'] = self.acquire_engine(self.model, beam_size=5)
+            self.engines['realtime'] = self.acquire_engine(self.realtime_model, beam_size=3)
+
+    def acquire_engine(self, model, beam_size):
+        key, engine = self.registry.acquire(model, self.device, self.compute_type)
+        self.model_keys.append(key)
+        # 浅拷贝只替换解码参数，模型权重仍然共享
+        view = copy.copy(engine)
+        view.config = dataclasses.replace(engine.config, beam_size=beam_size)
+        return view
+
+    def submit(self, source_id, role, audio, **kwargs):
+        """提交一个转录请求，返回 Future"""
+        future = Future()
+        with self.cond:
+            if not self.running:
+                future.set_exception(RuntimeError("Inference pool is shut down"))
+                return future
+            queue = self.pending.setdefault(source_id, deque())
+            if len(queue) >= self.max_pending:
+                # 只丢弃过时的实时转录请求，最终转录总是保留
+                stale = next((r for r in queue if r[0] == 'realtime'), None)
+                if stale:
+                    queue.remove(stale)
+                    stale[3].cancel()
+                    self.dropped += 1
+            queue.append((role, audio, kwargs, future))
+            if source_id not in self.order:
+                self.order.append(source_id)
+            self.cond.notify()
+        return future
+
+    def next_request(self):
+        """按音源轮询取出下一个请求，音源内部先处理最终转录"""
+        with self.cond:
+            while self.running and not self.order:
+                self.cond.wait()
+            if not self.running:
+                return None
+            source_id = self.order.popleft()
+            queue = self.pending[source_id]
+            request = next((r for r in queue if r[0] == 'main'), queue[0])
+            queue.remove(request)
+            if queue:
+                self.order.append(source_id)
+            return request
+
+    def worker_loop(self):
+        while True:
+            request = self.next_request()
+            if request is None:
+                return
+            role, audio, kwargs, future = request
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                if role == 'detect':
+                    future.set_result(self.detect_language(audio))
+                else:
+                    future.set_result(self.engines[role].transcribe(audio, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+
+    def detect_language(self, audio):
+        """语言识别，返回 (语言, 置信度)；用较小的实时模型即可"""
+        engine = self.engines['realtime']
+        model = getattr(engine, 'model', None)
+        if hasattr(model, 'detect_language'):  # faster-whisper >= 1.0 只跑编码器和一步解码
+            language, probability, _ = model.detect_language(audio)
+            return language, probability
+        info = engine.transcribe(audio, language=None, use_prompt=False).info
+        return info.language, info.language_probability
+
+    def executor(self, source_id, role):
+        """返回供 AudioToTextRecorder 使用的转录执行器"""
+        def transcribe(audio, **kwargs):
+            if self.auto_language:
+                tracker = self.languages.setdefault(source_id, LanguageTracker())
+                if role == 'main':
+                    # 每句话只识别开头几秒的语言，整句转录时固定使用会话语言
+                    head = audio[:int(self.LANGUAGE_ID_SECONDS * self.SAMPLE_RATE)]
+                    try:
+                        tracker.observe(*self.submit(source_id, 'detect', head).result())
+                    except Exception as e:
+                        print(f"Language detection error: {e}")
+                # 语言还没确定时交给模型自己检测
+                kwargs['language'] = tracker.language
+            return self.submit(source_id, role, audio, **kwargs).result()
+        return transcribe
+
+    def language(self, source_id):
+        """音源当前的会话语言（未确定或非自动模式时为 None）"""
+        tracker = self.languages.get(source_id)
+        return tracker.language if tracker else None
+
+    def stats(self):
+        return {
+            'name': 'inference',
+            'policy': QUEUE_POLICIES['inference']['policy'],
+            'depth': sum(len(q) for q in self.pending.values()),
+            'maxsize': self.max_pending * max(1, len(self.pending)),
+            'dropped': self.dropped,
+        }
+
+    def shutdown(self):
+        with self.cond:
+            self.running = False
+            for queue in self.pending.values():
+                for _, _, _, future in queue:
+                    future.cancel()
+            self.pending.clear()
+            self.order.clear()
+            self.cond.notify_all()
+            self.engines = {}
+            keys, self.model_keys = self.model_keys, []
+        for key in keys:
+            self.registry.release(key)
+
+class SystemClock:
+    """真实时钟"""
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+class ReplayClock(SystemClock):
+    """回放时钟：按录制时的时间轴走，speed 为回放倍速
+
+    回放期间各组件看到的时间与录制时一致，节流、延迟预算等逻辑的行为也就可以复现。
+    """
+
+    def __init__(self, start_time=0.0, speed=1.0):
+        self.start_time = start_time
+        self.speed = speed
+        self.origin = None
+        self.paused_at = None
+
+    def start(self):
+        """开始走时；暂停后再次调用则从暂停处继续"""
+        now = time.monotonic()
+        if self.origin is None:
+            self.origin = now
+        elif self.paused_at is not None:
+            self.origin += now - self.paused_at
+        self.paused_at = None
+
+    def pause(self):
+        """暂停走时，回放线程在 sleep_until 中等待"""
+        if self.origin is not None and self.paused_at is None:
+            self.paused_at = time.monotonic()
+
+    def time(self):
+        if self.origin is None:
+            return self.start_time
+        now = self.paused_at if self.paused_at is not None else time.monotonic()
+        return self.start_time + (now - self.origin) * self.speed
+
+    def sleep(self, seconds):
+        time.sleep(seconds / self.speed)
+
+    def sleep_until(self, timestamp, should_stop=None):
+        """等到回放时间到达 timestamp；暂停期间一直等待，should_stop() 为真时提前返回"""
+        while not (should_stop and should_stop()):
+            remaining = timestamp - self.time()
+            if remaining <= 0:
+                return
+            time.sleep(min(remaining / self.speed, 0.05))
+
+class SteppedClock(SystemClock):
+    """手动推进的时钟：sleep 不等待，直接把时间拨到目标时刻
+
+    无界面回放用它按事件时间戳逐步推进，输出与机器快慢、线程调度无关。
+    """
+
+    def __init__(self, start_time=0.0):
+        self.now = start_time
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += max(seconds, 0)
+
+    def sleep_until(self, timestamp, should_stop=None):
+        self.now = max(self.now, timestamp)
+
+class SessionRecorder:
+    """录制会话：原始 PCM 音频 + 带时间戳的事件日志
+
+    目录结构:
+      meta.json          采样率、音源名称、开始时间
+      audio-<音源>.pcm   16kHz 16bit 单声道原始音频
+      events.jsonl.gz    每行 [毫秒, 类型, 音源, 数据]，类型为
+                         audio / partial / final / translation / ui，
+                         audio 的数据是该块在 pcm 文件中的 [偏移, 长度]
+    """
+
+    SAMPLE_RATE = 16000
+
+    def __init__(self, root, track_names):
+        self.directory = os.path.join(root, time.strftime("session-%Y%m%d-%H%M%S"))
+        os.makedirs(self.directory, exist_ok=True)
+        self.start = time.monotonic()
+        self.lock = Lock()
+        self.audio_files = {}
+        self.audio_offsets = {}
+        self.events = gzip.open(os.path.join(self.directory, "events.jsonl.gz"), "wt", encoding="utf-8")
+        with open(os.path.join(self.directory, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({'sample_rate': self.SAMPLE_RATE, 'tracks': list(track_names),
+                       'start_time': time.time()}, f, ensure_ascii=False)
+
+    def elapsed_ms(self):
+        return int((time.monotonic() - self.start) * 1000)
+
+    def record_audio(self, track, chunk):
+        with self.lock:
+            if self.events is None:
+                return
+            f = self.audio_files.get(track)
+            if f is None:
+                f = self.audio_files[track] = open(os.path.join(self.directory, f"audio-{track}.pcm"), "wb")
+                self.audio_offsets[track] = 0
+            offset = self.audio_offsets[track]
+            f.write(chunk)
+            self.audio_offsets[track] = offset + len(chunk)
+            self.write_event(['audio', track, [offset, len(chunk)]])
+
+    def record_event(self, kind, track, text):
+        with self.lock:
+            if self.events is not None:
+                self.write_event([kind, track, text])
+
+    def write_event(self, event):
+        self.events.write(json.dumps([self.elapsed_ms()] + event, ensure_ascii=False) + "\n")
+
+    def close(self):
+        with self.lock:
+            if self.events is None:
+                return
+            self.events.close()
+            self.events = None
+            for f in self.audio_files.values():
+                f.close()
+
+class SessionReplay:
+    """读取 SessionRecorder 录制的会话"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        with gzip.open(os.path.join(directory, "events.jsonl.gz"), "rt", encoding="utf-8") as f:
+            self.events = [json.loads(line) for line in f if line.strip()]
+
+    @property
+    def track_names(self):
+        return self.meta['tracks']
+
+    def iter_events(self, track=None, kinds=None):
+        """按时间顺序产生 (秒, 类型, 音源, 数据)"""
+        for ms, kind, event_track, data in self.events:
+            if (track is None or event_track == track) and (kinds is None or kind in kinds):
+                yield ms / 1000, kind, event_track, data
+
+    def iter_audio(self, track):
+        """按时间顺序产生 (秒, PCM 数据块)"""
+        path = os.path.join(self.directory, f"audio-{track}.pcm")
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as f:
+            for seconds, _, _, (offset, length) in self.iter_events(track, ('audio',)):
+                f.seek(offset)
+                yield seconds, f.read(length)
+
+class Transcriber:
+    """语音识别后端接口（与 AudioToTextRecorder 的用法一致）
+
+    构造参数就是识别配置，回调通过配置传入：
+    on_realtime_transcription_update(text)、on_recorded_chunk(chunk)、
+    on_recording_start()、on_recording_stop()。
+    text() 阻塞到下一句最终转录（停止时返回空字符串）。
+    """
+    name = "base"
+
+    @property
+    def is_running(self):
+        raise NotImplementedError
+
+    def text(self):
+        raise NotImplementedError
+
+    def feed_audio(self, chunk):
+        """use_microphone=False 时送入 16 kHz 单声道 int16 PCM"""
+        raise NotImplementedError
+
+    def stop(self):
+        """停止当前这句话的录音（暂停）"""
+        raise NotImplementedError
+
+    def shutdown(self):
+        raise NotImplementedError
+
+class RealtimeSTTTranscriber(Transcriber):
+    """RealtimeSTT 的 AudioToTextRecorder（默认后端）"""
+    name = "realtimestt"
+
+    def __init__(self, **config):
+        self.recorder = AudioToTextRecorder(**config)
+
+    @property
+    def is_running(self):
+        return self.recorder.is_running
+
+    def text(self):
+        return self.recorder.text()
+
+    def feed_audio(self, chunk):
+        self.recorder.feed_audio(chunk)
+
+    def stop(self):
+        self.recorder.stop()
+
+    def shutdown(self):
+        self.recorder.shutdown()
+
+class FasterWhisperTranscriber(Transcriber):
+    """直接用 faster-whisper 引擎的流式识别
+
+    webrtcvad 切分语音，说话期间每隔 realtime_processing_pause 秒对已录音频
+    做一次实时转录，静音超过 post_speech_silence_duration 秒后做最终转录。
+    转录通过推理池的执行器完成（没有推理池时从模型注册表取模型）。
+    """
+    name = "faster-whisper"
+    SAMPLE_RATE = 16000
+    FRAME_SAMPLES = 480  # webrtcvad 只接受 10/20/30 ms 的帧，这里用 30 ms
+    PRE_ROLL_FRAMES = 10  # 语音开始前保留的帧，避免吃掉第一个音
+
+    def __init__(self, **config):
+        import numpy as np
+        import webrtcvad
+        self.np = np
+        self.config = config
+        self.language = config.get('language') or None
+        self.vad = webrtcvad.Vad(config.get('webrtc_sensitivity', 3))
+        self.silence_duration = config.get('post_speech_silence_duration', 0.4)
+        self.min_length = config.get('min_length_of_recording', 0.3)
+        self.realtime_pause = max(0.1, config.get('realtime_processing_pause', 0.2))
+        self.model_keys = []
+        self.transcribe_final = config.get('transcription_executor') or self.own_engine(config.get('model', 'tiny'))
+        self.transcribe_realtime = (config.get('realtime_transcription_executor')
+                                    or self.own_engine(config.get('realtime_model_type', 'tiny')))
+
+        self.frames = []  # 当前这句话的 PCM 帧
+        self.pre_roll = deque(maxlen=self.PRE_ROLL_FRAMES)
+        self.recording = False
+        self.silent_frames = 0
+        self.frames_version = 0
+        self.listening = False
+        self.finals = BoundedQueue.for_stage('stt_final')
+        # 切好的句子按顺序由一个线程做最终转录：推理池有多个工作线程，
+        # 每句一个线程的话短句可能先于前一句完成，最终转录就乱序了
+        self.utterances = BoundedQueue.for_stage('stt_utterance')
+        self.pending = b""
+        self.lock = Lock()
+        self.running = True
+        self.stream = None
+        # 很多设备不支持 16 kHz：按设备默认采样率打开，采集后重采样到 16 kHz
+        self.capture_rate = self.SAMPLE_RATE
+        self.resample_tail = np.zeros(0, dtype=np.float32)  # 上一块的最后一个采样
+        self.resample_pos = 0.0  # 下一个输出采样在 [tail, 本块] 中的位置
+        if config.get('use_microphone', True):
+            self.pa = pyaudio.PyAudio()
+            device_index = config.get('input_device_index')
+            info = (self.pa.get_device_info_by_index(device_index) if device_index is not None
+                    else self.pa.get_default_input_device_info())
+            self.capture_rate = int(info.get('defaultSampleRate') or self.SAMPLE_RATE)
+            self.stream = self.pa.open(
+                format=pyaudio.paInt16, channels=1, rate=self.capture_rate, input=True,
+                frames_per_buffer=self.capture_frames(), input_device_index=device_index)
+            Thread(target=self.capture_loop, daemon=True).start()
+        Thread(target=self.realtime_loop, daemon=True).start()
+        Thread(target=self.finalize_loop, daemon=True).start()
+
+    def own_engine(self, model):
+        key, engine = MODEL_REGISTRY.acquire(model, self.config.get('device', 'cuda'))
+        self.model_keys.append(key)
+        return engine.transcribe
+
+    @property
+    def is_running(self):
+        return self.running
+
+    def capture_frames(self):
+        """设备采样率下一个 30 ms 帧的采样数"""
+        return max(1, round(self.FRAME_SAMPLES * self.capture_rate / self.SAMPLE_RATE))
+
+    def capture_loop(self):
+        frames = self.capture_frames()
+        while self.running:
+            try:
+                chunk = self.stream.read(frames, exception_on_overflow=False)
+            except OSError as e:
+                print(f"Audio capture error: {e}")
+                self.running = False  # 看门狗会发现没有音频帧
+                return
+            if self.capture_rate != self.SAMPLE_RATE:
+                chunk = self.resample(chunk)
+            self.feed_audio(chunk)
+
+    def resample(self, chunk):
+        """把设备采样率的 int16 PCM 线性插值到 16 kHz，相位跨块连续"""
+        np = self.np
+        samples = np.concatenate((self.resample_tail,
+                                  np.frombuffer(chunk, dtype=np.int16).astype(np.float32)))
+        if len(samples) < 2:
+            self.resample_tail = samples
+            return b""
+        step = self.capture_rate / self.SAMPLE_RATE
+        positions = np.arange(self.resample_pos, len(samples) - 1, step)
+        resampled = np.interp(positions, np.arange(len(samples)), samples)
+        next_pos = positions[-1] + step if len(positions) else self.resample_pos
+        self.resample_tail = samples[-1:]
+        self.resample_pos = next_pos - (len(samples) - 1)
+        return np.round(resampled).astype(np.int16).tobytes()
+
+    def feed_audio(self, chunk):
+        callback = self.config.get('on_recorded_chunk')
+        if callback:
+            callback(chunk)
+        frame_bytes = self.FRAME_SAMPLES * 2
+        self.pending += chunk
+        while len(self.pending) >= frame_bytes:
+            frame, self.pending = self.pending[:frame_bytes], self.pending[frame_bytes:]
+            self.process_frame(frame)
+
+    def process_frame(self, frame):
+        speech = self.vad.is_speech(frame, self.SAMPLE_RATE)
+        with self.lock:
+            if not self.listening:
+                return
+            if not self.recording:
+                self.pre_roll.append(frame)
+                if not speech:
+                    return
+                self.recording = True
+                self.frames = list(self.pre_roll)
+                self.silent_frames = 0
+                self.callback('on_recording_start')
+                return
+            self.frames.append(frame)
+            self.frames_version += 1
+            self.silent_frames = 0 if speech else self.silent_frames + 1
+            if self.silent_frames * self.FRAME_SAMPLES < self.silence_duration * self.SAMPLE_RATE:
+                return
+            frames, self.frames = self.frames, []
+            self.recording = False
+            self.pre_roll.clear()
+        self.callback('on_recording_stop')
+        if len(frames) * self.FRAME_SAMPLES >= self.min_length * self.SAMPLE_RATE:
+            # 最终转录在 finalize_loop 里做，不阻塞音频采集
+            self.utterances.put(frames, pinned=True)
+
+    def callback(self, name, *args):
+        callback = self.config.get(name)
+        if callback:
+            callback(*args)
+
+    def to_audio(self, frames):
+        return self.np.frombuffer(b"".join(frames), dtype=self.np.int16).astype(self.np.float32) / 32768.0
+
+    def transcribe(self, executor, frames):
+        result = executor(self.to_audio(frames), language=self.language)
+        return (getattr(result, 'text', result) or "").strip()
+
+    def finalize_loop(self):
+        while self.running:
+            try:
+                frames = self.utterances.get(timeout=0.1)
+            except Empty:
+                continue
+            self.finalize(frames)
+
+    def finalize(self, frames):
+        try:
+            text = self.transcribe(self.transcribe_final, frames)
+        except Exception as e:
+            print(f"Transcription error: {e}")
+            return
+        if text:
+            self.finals.put(text)
+
+    def realtime_loop(self):
+        version = 0
+        while self.running:
+            time.sleep(self.realtime_pause)
+            with self.lock:
+                if not self.recording or self.frames_version == version:
+                    continue
+                version = self.frames_version
+                frames = list(self.frames)
+            try:
+                text = self.transcribe(self.transcribe_realtime, frames)
+            except Exception as e:
+                print(f"Realtime transcription error: {e}")
+                continue
+            if text and self.recording:
+                self.callback('on_realtime_transcription_update', text)
+
+    def text(self):
+        self.listening = True
+        while self.running and self.listening:
+            try:
+                return self.finals.get(timeout=0.1)
+            except Empty:
+                continue
+        return ""
+
+    def stop(self):
+        with self.lock:
+            self.listening = False
+            was_recording, self.recording = self.recording, False
+            self.frames = []
+        if was_recording:
+            self.callback('on_recording_stop')
+
+    def shutdown(self):
+        self.stop()
+        self.running = False
+        if self.stream:
+            self.stream.stop_stream()
+            self.stream.close()
+            self.pa.terminate()
+        keys, self.model_keys = self.model_keys, []
+        for key in keys:
+            MODEL_REGISTRY.release(key)
+
+class MockTranscriber(Transcriber):
+    """按脚本输出实时转录和最终转录的模拟后端，不需要模型和音频设备
+
+    每句话按词（中日文按字）逐步增长，以 mock_partial_rate 次/秒发出实时
+    转录，说完后发出最终转录，句间停顿 mock_pause 秒。速率为 0 时不限速，
+    用于压测翻译调度、界面合并和广播。同样的脚本和速率总是得到同样的事件序列。
+    """
+    name = "mock"
+    SCRIPT = [
+        "Hello everyone and welcome to the stream.",
+        "Today we are testing the realtime subtitle pipeline.",
+        "今天我们来测试一下实时字幕。",
+        "The quick brown fox jumps over the lazy dog.",
+    ]
+
+    def __init__(self, **config):
+        self.config = config
+        script = config.get('mock_script') or self.SCRIPT
+        if isinstance(script, str):  # 脚本文件，每行一句
+            with open(script, encoding="utf-8") as f:
+                script = [line.strip() for line in f if line.strip()]
+        self.script = script
+        self.partial_rate = config.get('mock_partial_rate', 10.0)
+        self.pause = config.get('mock_pause', 0.5)
+        self.loops = config.get('mock_loops', 0)  # 0 表示一直循环
+        self.finals = BoundedQueue.for_stage('stt_final')
+        self.listening = Event()
+        self.running = True
+        self.emitted = {'partial': 0, 'final': 0}
+        Thread(target=self.script_loop, daemon=True).start()
+
+    @property
+    def is_running(self):
+        return self.running
+
+    @staticmethod
+    def steps(sentence):
+        """一句话逐步增长的实时转录"""
+        tokens = re.findall(r'\S+\s*', sentence) if ' ' in sentence else list(sentence)
+        return ["".join(tokens[:i]).strip() for i in range(1, len(tokens) + 1)]
+
+    def script_loop(self):
+        interval = 1.0 / self.partial_rate if self.partial_rate else 0.0
+        chunk = bytes(int(16000 * 2 * max(interval, 0.03)))  # 静音帧，供录制和看门狗心跳使用
+        next_time = time.time()
+        loop = 0
+        while self.running and (not self.loops or loop < self.loops):
+            loop += 1
+            for sentence in self.script:
+                self.listening.wait()
+                if not self.running:
+                    return
+                self.callback('on_recording_start')
+                for partial in self.steps(sentence):
+                    # 按计划时间发出，不累积 sleep 的误差；落后时不等待直接追上
+                    next_time = max(next_time + interval, time.time() - 1.0)
+                    delay = next_time - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+                    if not self.running:
+                        return
+                    self.callback('on_recorded_chunk', chunk)
+                    self.callback('on_realtime_transcription_update', partial)
+                    self.emitted['partial'] += 1
+                self.callback('on_recording_stop')
+                self.finals.put(sentence)
+                self.emitted['final'] += 1
+                if self.pause:
+                    time.sleep(self.pause)
+                    next_time = time.time()
+        self.running = False
+
+    def callback(self, name, *args):
+        callback = self.config.get(name)
+        if callback:
+            callback(*args)
+
+    def text(self):
+        self.listening.set()
+        while self.running or self.finals.qsize():
+            try:
+                return self.finals.get(timeout=0.1)
+            except Empty:
+                if not self.listening.is_set():
+                    return ""
+        return ""
+
+    def feed_audio(self, chunk):
+        pass
+
+    def stop(self):
+        self.listening.clear()
+
+    def shutdown(self):
+        self.running = False
+        self.listening.set()
+
+TRANSCRIBERS = {cls.name: cls for cls in (RealtimeSTTTranscriber, FasterWhisperTranscriber, MockTranscriber)}
+
+def create_transcriber(config):
+    """按配置中的 backend 创建识别后端（默认 RealtimeSTT）"""
+    config = dict(config)
+    backend = config.pop('backend', RealtimeSTTTranscriber.name)
+    return TRANSCRIBERS[backend](**config)
+
+class STTThread(QThread):
+    text_signal = pyqtSignal(int)  # 参数为音源序号，文本通过 take_text() 取出
+    final_signal = pyqtSignal(int, str)  # 一句话说完后的最终转录
+    model_ready_signal = pyqtSignal()
+    error_signal = pyqtSignal(int, str)  # 识别线程异常退出
+    # 看门狗阈值（秒）
+    AUDIO_TIMEOUT = 5.0  # 识别中多久收不到音频帧算卡死
+    PARTIAL_TIMEOUT = 8.0  # 检测到语音后多久没有实时转录算卡死
+    LOAD_TIMEOUT = 60.0  # 重启后多久还没就绪算失败
+
+    def __init__(self, config, source_id=0, inference_pool=None):
+        super().__init__()
+        self.source_id = source_id
+        self.inference_pool = inference_pool
+        # 添加实时转录相关配置
+        self.config = config.copy()
+        self.config.update({
+            'on_realtime_transcription_update': self.process_text,  # 实时转录回调
+            'on_recorded_chunk': self.process_chunk,  # 原始音频回调（用于会话录制和心跳）
+            'on_recording_start': self.on_speech_start,  # VAD 检测到语音
+            'on_recording_stop': self.on_speech_stop
+        })
+        self.session_recorder = None
+        # 心跳（time.time()），由看门狗检查
+        self.started_at = time.time()
+        self.ready_at = None
+        self.resumed_at = None
+        self.last_audio = None
+        self.last_partial = None
+        self.speech_since = None
+        self.error = None
+        self.running = True
+        self.recorder = None
+        self.paused = True
+        self.last_text = ""
+        # 界面来不及处理时只保留最新文本，避免 Qt 信号无限堆积
+        self.outbox = BoundedQueue.for_stage('stt_ui')
+        self.notify_pending = False
+
+    def run(self):
+        try:
+            if not self.recorder:
+                if self.inference_pool:
+                    self.inference_pool.load()
+                # 创建录音器（识别后端由配置中的 backend 决定）
+                self.recorder = create_transcriber(self.config)
+                
+                # 等待 recorder.is_running 变为 True
+                while not self.recorder.is_running:
+                    if not self.running:
+                        return
+                    self.msleep(100)
+                
+                # 发送模型就绪信号
+                self.ready_at = time.time()
+                self.model_ready_signal.emit()
+
+            # 开始录音和识别循环
+            while self.running:
+                if not self.paused:
+                    # 不再需要传递回调函数，因为已经在配置中设置了
+                    text = self.recorder.text()
+                    if text and self.running and not self.paused:
+                        self.emit_final(text)
+                else:
+                    self.msleep(100)
+                
+        except Exception as e:
+            print(f"Error in STT Thread: {e}")
+            self.error = str(e) or type(e).__name__
+            self.error_signal.emit(self.source_id, self.error)
+
+    def process_text(self, text):
+        """处理实时转录的文本"""
+        self.last_partial = time.time()
+        if not self.running or self.paused:
+             return
+        if text != self.last_text and self.running:
+            self.last_text = text
+            # 发送文本用于显示
+            if text:
+                if self.session_recorder:
+                    self.session_recorder.record_event('partial', self.source_id, text)
+                self.outbox.put(text)
+                if not self.notify_pending:
+                    self.notify_pending = True
+                    self.text_signal.emit(self.source_id)
+
+    def emit_final(self, text):
+        if self.session_recorder:
+            self.session_recorder.record_event('final', self.source_id, text)
+        self.final_signal.emit(self.source_id, text)
+
+    def on_speech_start(self):
+        self.speech_since = time.time()
+
+    def on_speech_stop(self):
+        self.speech_since = None
+
+    def stall_reason(self, now):
+        """看门狗检查：线程已故障或卡死时返回原因，否则返回 None"""
+        if self.error:
+            return f"识别线程异常退出: {self.error}"
+        if self.ready_at is None:
+            return "模型加载超时" if now - self.started_at > self.LOAD_TIMEOUT else None
+        if not self.isRunning():
+            return "识别线程已退出"
+        if self.paused:
+            return None
+        if now - max(self.last_audio or 0, self.resumed_at or 0) > self.AUDIO_TIMEOUT:
+            return "收不到音频帧"
+        if (self.speech_since and now - self.speech_since > self.PARTIAL_TIMEOUT
+                and now - max(self.last_partial or 0, self.speech_since) > self.PARTIAL_TIMEOUT):
+            return "检测到语音但没有实时转录"
+        return None
+
+    def process_chunk(self, chunk):
+        """录制原始音频"""
+        self.last_audio = time.time()
+        if self.session_recorder and not self.paused:
+            self.session_recorder.record_audio(self.source_id, chunk)
+
+    def take_text(self):
+        """由界面线程调用，取出最新的识别文本（没有则返回 None）"""
+        self.notify_pending = False
+        try:
+            return self.outbox.get_nowait()
+        except Empty:
+            return None
+
+    def pause(self):
+        """暂停录音"""
+        if self.recorder:
+            self.paused = True
+            self.recorder.stop()
+
+    def resume(self):
+        """恢复录音"""
+        self.resumed_at = time.time()
+        self.paused = False
+
+    def stop(self, timeout=3.0):
+        """停止线程（最多等待 timeout 秒）"""
+        self.running = False
+        if self.recorder:
+            self.recorder.stop()
+        if not self.wait(int(timeout * 1000)):
+            print("STT thread did not stop in time")
+
+class ReplayThread(STTThread):
+    """回放一个音源的录制内容，接口与 STTThread 相同
+
+    feed_audio=False 时直接按录制时间重放识别事件（用于排查翻译/界面问题）；
+    feed_audio=True 时把录制的 PCM 按原时间送入识别后端重新识别。
+    """
+
+    def __init__(self, config, source_id, replay, clock, feed_audio=False, inference_pool=None):
+        config = dict(config)
+        config['use_microphone'] = False
+        config.pop('input_device_index', None)
+        super().__init__(config, source_id, inference_pool)
+        self.replay = replay
+        self.clock = clock
+        self.feed_audio = feed_audio
+
+    def run(self):
+        try:
+            if self.feed_audio:
+                if self.inference_pool:
+                    self.inference_pool.load()
+                self.recorder = create_transcriber(self.config)
+                Thread(target=self.final_loop, daemon=True).start()
+            self.model_ready_signal.emit()
+
+            start = self.replay.meta.get('start_time', 0)
+            if self.feed_audio:
+                for seconds, chunk in self.replay.iter_audio(self.source_id):
+                    if not self.wait_for(start + seconds):
+                        return
+                    self.recorder.feed_audio(chunk)
+            else:
+                for seconds, kind, _, text in self.replay.iter_events(self.source_id, ('partial', 'final')):
+                    if not self.wait_for(start + seconds):
+                        return
+                    if kind == 'partial':
+                        self.process_text(text)
+                    else:
+                        self.emit_final(text)
+        except Exception as e:
+            print(f"Error in replay thread: {e}")
+
+    def wait_for(self, timestamp):
+        """等到下一条录制内容的时间；暂停期间不推进，线程停止时返回 False"""
+        while True:
+            while self.running and self.paused:
+                self.msleep(50)
+            self.clock.sleep_until(timestamp, lambda: not self.running or self.paused)
+            if not self.running:
+                return False
+            if not self.paused:
+                return True
+
+    def final_loop(self):
+        while self.running:
+            text = self.recorder.text()
+            if text and self.running:
+                self.emit_final(text)
+
+    def pause(self):
+        self.paused = True
+
+class AhoCorasick:
+    """Aho-Corasick 多模式匹配自动机，构建一次后匹配耗时只与文本长度有关"""
+
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [-1]  # 节点对应的模式长度，-1 表示不是终止节点
+        self.dict_link = [0]  # 沿失败链最近的终止节点
+        for pattern in patterns:
+            self.add(pattern)
+        self.build()
+
+    def add(self, pattern):
+        if not pattern:
+            return
+        node = 0
+        for char in pattern:
+            nxt = self.goto[node].get(char)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][char] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(-1)
+                self.dict_link.append(0)
+            node = nxt
+        self.output[node] = len(pattern)
+
+    def build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and char not in self.goto[f]:
+                    f = self.fail[f]
+                target = self.goto[f].get(char, 0)
+                self.fail[nxt] = target if target != nxt else 0
+                fail = self.fail[nxt]
+                self.dict_link[nxt] = fail if self.output[fail] >= 0 else self.dict_link[fail]
+
+    def iter_matches(self, text):
+        """产生所有 (起始位置, 结束位置) 匹配，可能互相重叠"""
+        node = 0
+        for i, char in enumerate(text):
+            while node and char not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(char, 0)
+            hit = node if self.output[node] >= 0 else self.dict_link[node]
+            while hit:
+                yield i + 1 - self.output[hit], i + 1
+                hit = self.dict_link[hit]
+
+    def find(self, text):
+        """返回最左最长、互不重叠的匹配"""
+        matches = sorted(self.iter_matches(text), key=lambda m: (m[0], -m[1]))
+        result = []
+        last_end = 0
+        for start, end in matches:
+            if start >= last_end:
+                result.append((start, end))
+                last_end = end
+        return result
+
+class Glossary:
+    """用户术语表：翻译前保护/替换专有名词，翻译后还原
+
+    文件每行一条 `原文<Tab>译文` 或 `原文=译文`，译文为空表示原样保留，
+    `#` 开头为注释。文件修改后在后台线程重建自动机，翻译路径上只做一次引用替换。
+    """
+
+    PLACEHOLDER = "⟦{}⟧"
+    PLACEHOLDER_PATTERN = re.compile(r'⟦(\d+)⟧')
+    RELOAD_INTERVAL = 1.0
+
+    def __init__(self, path=None):
+        self.path = path
+        self.table = None  # (自动机, 术语字典)，整体替换，读取方不会拿到新旧混合的一对
+        self.mtime = None
+        self.last_check = 0
+        self.reloading = False
+        if path:
+            self.reload()
+
+    @staticmethod
+    def parse(path):
+        entries = {}
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                sep = '\t' if '\t' in line else '='
+                source, _, target = line.partition(sep)
+                source, target = source.strip(), target.strip()
+                if source:
+                    entries[source.lower()] = target
+        return entries
+
+    def reload(self):
+        """重新读取术语表并构建自动机，构建完成后原子替换"""
+        try:
+            mtime = os.path.getmtime(self.path)
+            entries = self.parse(self.path)
+            matcher = AhoCorasick(entries)
+        except Exception as e:
+            print(f"Failed to load glossary: {e}")
+        else:
+            self.table, self.mtime = (matcher, entries), mtime
+        finally:
+            self.reloading = False
+
+    def reload_async(self):
+        """在后台线程重建自动机（大术语表构建需要几百毫秒）"""
+        if self.path and not self.reloading:
+            self.reloading = True
+            Thread(target=self.reload, daemon=True).start()
+
+    def maybe_reload(self):
+        """文件有变化时在后台线程重建，避免阻塞翻译"""
+        now = time.time()
+        if not self.path or self.reloading or now - self.last_check < self.RELOAD_INTERVAL:
+            return
+        self.last_check = now
+        try:
+            changed = os.path.getmtime(self.path) != self.mtime
+        except OSError:
+            return
+        if changed:
+            self.reload_async()
+
+    @staticmethod
+    def is_word_char(char):
+        return char.isascii() and char.isalnum()
+
+    def find_terms(self, text):
+        """返回术语匹配 [(start, end, 译文)]，拉丁字母术语要求在单词边界上"""
+        table = self.table
+        if not table or not text:
+            return []
+        matcher, entries = table
+        lowered = text.lower()
+        if len(lowered) != len(text):
+            lowered = text
+        terms = []
+        for start, end in matcher.find(lowered):
+            if start > 0 and self.is_word_char(text[start]) and self.is_word_char(text[start - 1]):
+                continue
+            if end < len(text) and self.is_word_char(text[end - 1]) and self.is_word_char(text[end]):
+                continue
+            terms.append((start, end, entries[lowered[start:end]] or text[start:end]))
+        return terms
+
+    def protect(self, text):
+        """把术语替换为占位符，返回 (处理后的文本, 占位符译文列表, 是否只有术语)"""
+        terms = self.find_terms(text)
+        if not terms:
+            return text, [], False
+        parts, targets, residue = [], [], []
+        last = 0
+        for start, end, target in terms:
+            parts.append(text[last:start])
+            residue.append(text[last:start])
+            parts.append(self.PLACEHOLDER.format(len(targets)))
+            targets.append(target)
+            last = end
+        parts.append(text[last:])
+        residue.append(text[last:])
+        glossary_only = not re.sub(r'[\W_]+', '', ''.join(residue))
+        return ''.join(parts), targets, glossary_only
+
+    def restore(self, text, targets):
+        """把占位符还原为术语译文，去掉流式输出末尾不完整的占位符"""
+        if not targets:
+            return text
+        text = re.sub(r'⟦\d*$', '', text)
+        return self.PLACEHOLDER_PATTERN.sub(
+            lambda m: targets[int(m.group(1))] if int(m.group(1)) < len(targets) else m.group(0), text)
+
+class TranslationCancelled(Exception):
+    """Raised when a translation request is cancelled from outside"""
+
+class Translator:
+    """Translation backend interface"""
+    name = "base"
+
+    def translate(self, text, target_lang, on_partial=None, should_stop=None):
+        """Translate text, optionally reporting the growing result through on_partial"""
+        raise NotImplementedError
+
+    def warm_up(self):
+        """Load the model ahead of the first request (called on a background thread)"""
+
+class TranslationMetrics:
+    """Per-request Ollama counters, rolled up for the UI and appended to a CSV and a JSONL log
+
+    Ollama reports the counters on the final chunk of a stream (durations in
+    nanoseconds). A request whose load_duration exceeds cold_load_threshold
+    had to (re)load the model, which is what shows up as a slow first token.
+    A request that timed out before its first token never reports
+    load_duration; it is counted as a suspected load (cold_load "suspected").
+    """
+    FIELDS = ['time', 'model', 'status', 'chars', 'ttft_ms', 'prompt_eval_count', 'eval_count',
+              'prompt_eval_ms', 'eval_ms', 'load_ms', 'total_ms', 'tokens_per_sec', 'cold_load']
+
+    def __init__(self, log_dir="logs", window=200, cold_load_threshold=1.0):
+        self.log_dir = log_dir
+        self.cold_load_threshold = cold_load_threshold
+        self.recent = deque(maxlen=window)
+        self.requests = 0
+        self.failures = 0
+        self.load_events = 0
+        self.last_load = None  # (time, seconds, suspected); seconds is a lower bound when suspected
+        self.lock = Lock()
+        self.csv_file = None
+        self.csv_writer = None
+        self.jsonl_file = None
+
+    def record(self, request, status):
+        def ms(key):
+            value = request.get(key)
+            return round(value / 1e6, 1) if value is not None else None
+
+        eval_ms = ms('eval_duration')
+        load_ms = ms('load_duration')
+        suspected = status == 'timeout' and 'ttft' not in request
+        row = {
+            'time': round(time.time(), 3),
+            'model': request.get('model'),
+            'status': status,
+            'chars': request.get('chars'),
+            'ttft_ms': round(request['ttft'] * 1000, 1) if 'ttft' in request else None,
+            'prompt_eval_count': request.get('prompt_eval_count'),
+            'eval_count': request.get('eval_count'),
+            'prompt_eval_ms': ms('prompt_eval_duration'),
+            'eval_ms': eval_ms,
+            'load_ms': load_ms,
+            'total_ms': ms('total_duration'),
+            'tokens_per_sec': (round(request['eval_count'] / (eval_ms / 1000), 1)
+                               if eval_ms and request.get('eval_count') else None),
+            'cold_load': ('suspected' if suspected
+                          else bool(load_ms is not None and load_ms >= self.cold_load_threshold * 1000)),
+        }
+        with self.lock:
+            self.requests += 1
+            self.failures += status not in ('ok', 'cancelled')
+            if row['cold_load']:
+                self.load_events += 1
+                self.last_load = ((row['time'], request.get('waited', 0.0), True) if suspected
+                                  else (row['time'], load_ms / 1000, False))
+            self.recent.append(row)
+            self.write(row)
+
+    def write(self, row):
+        try:
+            if self.csv_file is None:
+                os.makedirs(self.log_dir, exist_ok=True)
+                csv_path = os.path.join(self.log_dir, "ollama-metrics.csv")
+                new_csv = not os.path.exists(csv_path)
+                self.csv_file = open(csv_path, "a", encoding="utf-8", newline="")
+                self.csv_writer = csv.writer(self.csv_file)  # Model names and error statuses may contain commas or quotes
+                if new_csv:
+                    self.csv_writer.writerow(self.FIELDS)
+                self.jsonl_file = open(os.path.join(self.log_dir, "ollama-metrics.jsonl"), "a", encoding="utf-8")
+            self.csv_writer.writerow(["" if row[f] is None else row[f] for f in self.FIELDS])
+            self.jsonl_file.write(json.dumps(row, ensure_ascii=False) + "\n")
+            self.csv_file.flush()
+            self.jsonl_file.flush()
+        except OSError as e:
+            print(f"Metrics log error: {e}")
+
+    def summary(self):
+        """Rollup over the recent window: throughput, TTFT percentiles, prompt size, load events"""
+        with self.lock:
+            rows = [r for r in self.recent if r['status'] == 'ok']
+            summary = {'requests': self.requests, 'failures': self.failures,
+                       'load_events': self.load_events, 'last_load': self.last_load}
+        eval_ms = sum(r['eval_ms'] or 0 for r in rows)
+        summary['tokens_per_sec'] = sum(r['eval_count'] or 0 for r in rows) / (eval_ms / 1000) if eval_ms else None
+        ttft = sorted(r['ttft_ms'] for r in rows if r['ttft_ms'] is not None)
+        summary['ttft_p50'] = ttft[len(ttft) // 2] if ttft else None
+        summary['ttft_p95'] = ttft[min(len(ttft) - 1, int(len(ttft) * 0.95))] if ttft else None
+        prompts = [r['prompt_eval_count'] for r in rows if r['prompt_eval_count'] is not None]
+        summary['prompt_tokens'] = sum(prompts) / len(prompts) if prompts else None
+        return summary
+
+    def close(self):
+        with self.lock:
+            for f in (self.csv_file, self.jsonl_file):
+                if f:
+                    f.close()
+            self.csv_file = self.csv_writer = self.jsonl_file = None
+
+class OllamaTranslator(Translator):
+    """LLM translation through a local Ollama server (streaming)
+
+    Every request is bounded by a connect, a first-token and a total
+    deadline. The HTTP stream is read on a daemon thread, so a hung
+    connection never blocks the caller past its deadline or past
+    should_stop() turning true.
+
+    Ollama sends nothing while it loads a model, so while the model is not
+    known to be resident (no token within the last keep_alive seconds) the
+    first-token and total deadlines grow by load_timeout. Requests ask
+    Ollama to keep the model loaded for keep_alive seconds.
+    """
+    name = "ollama"
+
+    def __init__(self, model_name, connect_timeout=2.0, first_token_timeout=8.0, total_timeout=30.0,
+                 metrics=None, load_timeout=120.0, keep_alive=1800.0):
+        self.model_name = model_name
+        self.metrics = metrics
+        self.connect_timeout = connect_timeout
+        self.first_token_timeout = first_token_timeout
+        self.total_timeout = total_timeout
+        self.load_timeout = load_timeout
+        self.keep_alive = keep_alive
+        self.warm_until = 0.0  # The model should stay loaded until then
+
+    def warm_up(self):
+        """Load the model now (an empty prompt only loads it), so the first subtitle isn't a cold start"""
+        try:
+            client = ollama.Client(timeout=httpx.Timeout(
+                self.load_timeout, connect=self.connect_timeout))
+            client.generate(model=self.model_name, prompt="", keep_alive=self.keep_alive)
+            self.warm_until = time.time() + self.keep_alive
+        except Exception as e:
+            print(f"Ollama warm-up failed: {e}")
+
+    def translate(self, text, target_lang, on_partial=None, should_stop=None):
+        placeholder_note = ("\nKeep placeholders like ⟦0⟧ unchanged."
+                            if Glossary.PLACEHOLDER_PATTERN.search(text) else "")
+        prompt = f"""Translate the following text to {target_lang}.
+Only output the translation, no explanations.{placeholder_note}
+
+Text to translate: {text}"""
+
+        # Only the newest cumulative text matters, plus the final done/error marker
+        updates = BoundedQueue(2, 'keep_latest')
+        abandoned = False
+        request = {'model': self.model_name, 'chars': len(text)}
+        start = time.time()
+        # Leave room for a model (re)load when it may have been unloaded
+        load_allowance = self.load_timeout if start > self.warm_until else 0.0
+
+        def read_stream():
+            try:
+                client = ollama.Client(timeout=httpx.Timeout(
+                    self.total_timeout + load_allowance, connect=self.connect_timeout,
+                    read=self.first_token_timeout + load_allowance))
+                # Use streaming generation for translation
+                stream = client.generate(
+                    model=self.model_name,
+                    prompt=prompt,
+                    stream=True,
+                    keep_alive=self.keep_alive
+                )
+                translated_text = ""
+                for chunk in stream:
+                    if abandoned:
+                        return
+                    if "response" in chunk:
+                        if chunk["response"] and 'ttft' not in request:
+                            request['ttft'] = time.time() - start
+                            self.warm_until = time.time() + self.keep_alive
+                        translated_text += chunk["response"]
+                        updates.put(('text', translated_text), key='text')
+                    if "done" in chunk and chunk["done"]:
+                        # The last chunk carries the token counters and durations
+                        for key in ('prompt_eval_count', 'eval_count', 'prompt_eval_duration',
+                                    'eval_duration', 'load_duration', 'total_duration'):
+                            if key in chunk:
+                                request[key] = chunk[key]
+                updates.put(('done', translated_text), key='done')
+            except Exception as e:
+                updates.put(('error', e), key='done')
+
+        Thread(target=read_stream, daemon=True).start()
+        first_token_deadline = start + self.connect_timeout + self.first_token_timeout + load_allowance
+        total_deadline = start + self.total_timeout + load_allowance
+        got_token = False
+        status = 'error'
+        try:
+            while True:
+                if should_stop and should_stop():
+                    status = 'cancelled'
+                    raise TranslationCancelled()
+                now = time.time()
+                if not got_token and now > first_token_deadline:
+                    status = 'timeout'
+                    request['waited'] = now - start
+                    raise TimeoutError(f"no token from {self.model_name} after {now - start:.1f}s")
+                if now > total_deadline:
+                    status = 'timeout'
+                    raise TimeoutError(f"translation by {self.model_name} exceeded {self.total_timeout:.0f}s")
+                try:
+                    kind, value = updates.get(timeout=0.1)
+                except Empty:
+                    continue
+                if kind == 'error':
+                    raise value
+                if kind == 'done':
+                    status = 'ok'
+                    return value
+                got_token = True
+                if on_partial:
+                    on_partial(value)
+        finally:
+            abandoned = True
+            if self.metrics:
+                self.metrics.record(dict(request), status)
+
+class GlossaryTranslator(Translator):
+    """Dictionary fallback: only substitutes glossary terms, leaves the rest untouched"""
+    name = "glossary"
+
+    def __init__(self, glossary):
+        self.glossary = glossary
+
+    def translate(self, text, target_lang, on_partial=None, should_stop=None):
+        protected, terms, _ = self.glossary.protect(text)
+        return self.glossary.restore(protected, terms)
+
+class CTranslate2Translator(Translator):
+    """Small local CPU model (e.g. an OPUS-MT/Marian model converted with ct2-transformers-converter)
+
+    Marian models are trained for one language pair, so target_lang is ignored.
+    The model is loaded on first use so it never blocks the UI thread.
+    """
+    name = "ctranslate2"
+
+    def __init__(self, model_dir, threads=2):
+        self.model_dir = model_dir
+        self.threads = threads
+        self.translator = None
+        self.tokenizer = None
+
+    def load(self):
+        import ctranslate2
+        import transformers
+        self.translator = ctranslate2.Translator(self.model_dir, device="cpu",
+                                                 intra_threads=self.threads)
+        self.tokenizer = transformers.AutoTokenizer.from_pretrained(self.model_dir)
+
+    def translate(self, text, target_lang, on_partial=None, should_stop=None):
+        if self.translator is None:
+            self.load()
+        tokens = self.tokenizer.convert_ids_to_tokens(self.tokenizer.encode(text))
+        results = self.translator.translate_batch([tokens], beam_size=1, max_decoding_length=256)
+        output = results[0].hypotheses[0]
+        return self.tokenizer.decode(self.tokenizer.convert_tokens_to_ids(output),
+                                     skip_special_tokens=True)
+
+def normalize_source(text):
+    """Lower-case and drop punctuation/whitespace, so cosmetic edits compare equal"""
+    return re.sub(r'[\W_]+', '', text.lower())
+
+def source_hash(text):
+    return hashlib.sha1(normalize_source(text).encode('utf-8')).hexdigest()[:12]
+
+class TranslateThread(QThread):
+    translation_signal = pyqtSignal(int)  # Track index, fetch the text with take_translation()
+    final_translation_signal = pyqtSignal(int, int, str)  # Track, segment, translation of the final text
+    MIN_STABLE_UPDATES = 2  # A partial is translated speculatively once it has only grown this many times
+    REUSE_SIMILARITY = 0.9  # A final this close to the speculated source reuses its translation
+    ERROR_BACKOFF_MAX = 30.0  # Failed requests back off 1, 2, 4 ... s up to this; a restart wouldn't help
+    
+    def __init__(self, translator, target_lang, glossary=None, fallback=None, latency_budget=1.5,
+                 clock=None):
+        super().__init__()
+        self.clock = clock or SystemClock()  # A ReplayClock during replay, so gating behaves as recorded
+        self.session_recorder = None
+        self.translation_threshold = 0.8  # Translation threshold to prevent overload
+        self.translator = translator
+        self.target_lang = target_lang
+        self.glossary = glossary or Glossary()
+        self.queue = BoundedQueue.for_stage('translate')
+        self.outbox = {}  # track -> BoundedQueue, so a slow UI only ever sees the newest text
+        self.notify_pending = set()
+        self.running = True
+        self.last_translation_time = {}  # Per track, so one busy source can't starve the others
+        # Fallback path: if the newest text of a track has waited longer than
+        # latency_budget without any LLM output, the fallback translator shows
+        # something right away and the LLM result replaces it once complete.
+        self.fallback = fallback
+        self.latency_budget = latency_budget
+        self.lock = Lock()
+        self.seq = 0
+        self.latest = {}  # track -> (seq, text, enqueue time)
+        self.shown_seq = {}  # track -> seq of the text currently on screen
+        self.fallback_seq = {}  # track -> last seq translated by the fallback
+        self.current = None  # (track, source text, cancel event, segment) of the in-flight request
+        self.current_final = None  # (seq, track, text, segment) while a final is being translated
+        # Speculative translation: partials are tagged with their segment id;
+        # finished translations are cached per segment with the source hash so
+        # the final transcript can reuse them instead of waiting for the LLM.
+        self.stability = {}  # track -> (last partial, consecutive growing updates)
+        self.speculative = {}  # (track, segment) -> (source text, source hash, translation)
+        self.finalized = {}  # track -> last finalized segment
+        self.awaiting_final = {}  # (track, segment) -> (final text, seq) waiting on the in-flight partial
+        self.skipped = 0  # Texts already in the target language, never sent to the translator
+        # Watchdog state (wall clock, also during replay)
+        self.heartbeat = time.time()
+        self.consecutive_errors = 0
+        self.last_error = None
+        self.backoff_until = 0.0  # Wall clock time before which no request is sent
+        
+    def run(self):
+        if self.fallback:
+            Thread(target=self.fallback_loop, daemon=True).start()
+        Thread(target=self.translator.warm_up, daemon=True).start()
+        while self.running:
+            self.heartbeat = time.time()
+            self.glossary.maybe_reload()
+            if self.heartbeat < self.backoff_until:
+                # The backend is failing: wait instead of burning through the queue
+                time.sleep(min(0.1, self.backoff_until - self.heartbeat))
+                continue
+            try:
+                self.step(timeout=0.5)
+            except Empty:
+                continue
+
+    def step(self, timeout=None):
+        """Translate the next queued text; raises Empty if nothing arrives within timeout
+
+        run() calls this in a loop; the headless replay calls it directly so
+        the whole pipeline runs on one thread in a fixed order.
+        """
+        track, text, seq, segment, final = self.queue.get(timeout=timeout)
+        if final:
+            # Finals skip the gating, they are what stays on screen
+            self.translate_text(text, track, seq, segment, final=True)
+        elif text and segment > self.finalized.get(track, -1):
+            # Check if enough time has passed since last translation
+            current_time = self.clock.time()
+            if current_time - self.last_translation_time.get(track, 0) >= self.translation_threshold:
+                self.translate_text(text, track, seq, segment)
+                self.last_translation_time[track] = current_time
+
+    def publish(self, track, seq, text):
+        """Emit a translation unless a newer text of the same track is already shown"""
+        with self.lock:
+            if seq < self.shown_seq.get(track, 0):
+                return False
+            self.shown_seq[track] = seq
+            outbox = self.outbox.setdefault(track, BoundedQueue.for_stage('translation_ui'))
+            outbox.put(text)
+            if self.session_recorder:
+                self.session_recorder.record_event('translation', track, text)
+            notify = track not in self.notify_pending
+            self.notify_pending.add(track)
+        if notify:
+            self.translation_signal.emit(track)
+        return True
+
+    def take_translation(self, track):
+        """Called from the UI thread: newest translation of a track, or None"""
+        with self.lock:
+            self.notify_pending.discard(track)
+            outbox = self.outbox.get(track)
+        try:
+            return outbox.get_nowait() if outbox else None
+        except Empty:
+            return None
+                
+    def translate_text(self, text, track=0, seq=0, segment=0, final=False):
+        # Glossary terms are swapped for placeholders so the LLM doesn't touch them
+        try:
+            protected, terms, glossary_only = self.glossary.protect(text)
+        except Exception as e:
+            # A broken glossary must not take the translation thread down
+            print(f"Glossary error: {e}")
+            protected, terms, glossary_only = text, [], False
+        if glossary_only:
+            translated_text = self.glossary.restore(protected, terms)
+            self.publish(track, seq, translated_text)
+            self.finish_segment(track, segment, text, translated_text, final)
+            return
+
+        def on_partial(translated_text):
+            self.heartbeat = time.time()
+            # Stream into the UI, except when the fallback already shows this
+            # text: then keep it until the full LLM result is available
+            if self.fallback_seq.get(track) != seq:
+                self.publish(track, seq, self.glossary.restore(translated_text, terms))
+
+        cancelled = Event()
+        self.current = (track, text, cancelled, None if final else segment)
+        self.current_final = (seq, track, text, segment) if final else None
+        translated_text = None
+        try:
+            translated_text = self.translator.translate(
+                protected, self.target_lang, on_partial=on_partial,
+                should_stop=lambda: not self.running or cancelled.is_set())
+            translated_text = self.glossary.restore(translated_text, terms)
+            self.consecutive_errors = 0
+            if self.running:
+                # Also covers non-streaming backends and text held back for the fallback
+                self.publish(track, seq, translated_text)
+        except TranslationCancelled:
+            translated_text = None
+        except Exception as e:
+            translated_text = None
+            self.consecutive_errors += 1
+            self.last_error = str(e) or type(e).__name__
+            self.backoff_until = time.time() + min(2 ** (self.consecutive_errors - 1), self.ERROR_BACKOFF_MAX)
+            print(f"Translation error: {e}")
+            if final and self.running:
+                # Finals are retried after the backoff, partials are superseded anyway
+                self.queue.put((track, text, seq, segment, True), key=('final', track, segment), pinned=True)
+        finally:
+            self.finish_segment(track, segment, text, translated_text, final)
+
+    def reusable(self, cached_source, final_text):
+        """True if a translation of cached_source can stand in for final_text"""
+        a, b = normalize_source(cached_source), normalize_source(final_text)
+        return a == b or difflib.SequenceMatcher(None, a, b).ratio() >= self.REUSE_SIMILARITY
+
+    def finish_segment(self, track, segment, text, translated_text, final):
+        """Cache a finished speculative translation and serve a final waiting on it"""
+        with self.lock:
+            # Cleared together with caching, so add_final sees either one or the other
+            self.current = None
+            if final and self.running:
+                self.current_final = None
+            if final or not self.running:
+                if final and translated_text and self.running:
+                    self.final_translation_signal.emit(track, segment, translated_text)
+                return
+            if translated_text:
+                self.speculative[(track, segment)] = (text, source_hash(text), translated_text)
+                for key in [k for k in self.speculative if k[0] == track and k[1] < segment - 4]:
+                    del self.speculative[key]
+            waiting = self.awaiting_final.pop((track, segment), None)
+        if not waiting:
+            return
+        final_text, final_seq = waiting
+        if translated_text and self.reusable(text, final_text):
+            self.publish(track, final_seq, translated_text)
+            self.final_translation_signal.emit(track, segment, translated_text)
+        else:
+            self.queue.put((track, final_text, final_seq, segment, True), key=('final', track, segment), pinned=True)
+
+    def add_final(self, text, track=0, segment=0, language=None):
+        """Translate a finalized sentence, reusing the speculative translation of its partials when possible"""
+        with self.lock:
+            self.seq += 1
+            seq = self.seq
+            self.finalized[track] = segment
+        if language == self.target_lang:
+            self.skip_translation(track, seq, text)
+            return
+        with self.lock:
+            cached = self.speculative.pop((track, segment), None)
+            # 更早的句子不会再有最终转录了，丢掉它们的推测翻译
+            for key in [key for key in self.speculative if key[0] == track and key[1] < segment]:
+                del self.speculative[key]
+            current = self.current
+            in_flight = current and current[0] == track and current[3] == segment
+            if in_flight:
+                if self.reusable(current[1], text):
+                    self.awaiting_final[(track, segment)] = (text, seq)
+                    return
+                current[2].set()
+        self.latest[track] = (seq, text, self.clock.time())
+        if cached and (cached[1] == source_hash(text) or self.reusable(cached[0], text)):
+            self.publish(track, seq, cached[2])
+            self.final_translation_signal.emit(track, segment, cached[2])
+            return
+        self.queue.put((track, text, seq, segment, True), key=('final', track, segment), pinned=True)
+
+    def skip_translation(self, track, seq, text):
+        """The source is already in the target language: show it as is, no LLM call"""
+        self.skipped += 1
+        self.latest.pop(track, None)
+        self.cancel_current(track)
+        self.publish(track, seq, text)
+
+    def cancel_current(self, track=None):
+        """Cancel the in-flight request (optionally only if it belongs to track)"""
+        current = self.current
+        if current and (track is None or current[0] == track):
+            current[2].set()
+
+    def fallback_loop(self):
+        while self.running:
+            time.sleep(0.1)
+            now = self.clock.time()
+            for track, (seq, text, enqueued) in list(self.latest.items()):
+                if (now - enqueued < self.latency_budget
+                        or self.shown_seq.get(track, 0) >= seq
+                        or self.fallback_seq.get(track) == seq):
+                    continue
+                self.fallback_seq[track] = seq
+                try:
+                    self.publish(track, seq, self.fallback.translate(text, self.target_lang))
+                except Exception as e:
+                    print(f"Fallback translation error: {e}")
+            
+    def add_text(self, text, track=0, segment=0, language=None):
+        """Add a partial hypothesis of a segment to the translation queue"""
+        with self.lock:
+            self.seq += 1
+            seq = self.seq
+        if language == self.target_lang:
+            self.skip_translation(track, seq, text)
+            return
+        self.latest[track] = (seq, text, self.clock.time())
+        previous, stable = self.stability.get(track, ("", 0))
+        stable = stable + 1 if text.startswith(previous) else 0
+        self.stability[track] = (text, stable)
+        if stable >= self.MIN_STABLE_UPDATES:
+            self.queue.put((track, text, seq, segment, False), key=track)
+        # A revised hypothesis makes the in-flight translation useless; a
+        # hypothesis that only grows keeps it, so streaming partials still finish
+        current = self.current
+        if current and current[0] == track and current[3] is not None and not text.startswith(current[1]):
+            current[2].set()
+
+    def stall_reason(self, now):
+        """Watchdog check: why the thread needs a restart, or None if it is healthy"""
+        if self.running and not self.isRunning():
+            return "翻译线程已退出"
+        timeout = (getattr(self.translator, 'total_timeout', 30.0)
+                   + getattr(self.translator, 'load_timeout', 0.0) + 10.0)
+        if self.current and now - self.heartbeat > timeout:
+            return f"翻译请求 {now - self.heartbeat:.0f}s 没有输出"
+        return None
+
+    def queue_stats(self):
+        stats = [self.queue.stats()]
+        for outbox in list(self.outbox.values()):
+            stats.append(outbox.stats())
+        return stats
+        
+    def pending_finals(self):
+        """Finals that were never translated, oldest first: [(track, text, segment)]
+
+        Call after stop(); a replacement thread takes them over with adopt_finals().
+        """
+        with self.lock:
+            pending = [(seq, track, text, segment)
+                       for track, text, seq, segment, final in self.queue.pinned_items() if final]
+            pending += [(seq, track, text, segment)
+                        for (track, segment), (text, seq) in self.awaiting_final.items()]
+            if self.current_final:
+                pending.append(self.current_final)
+        return [(track, text, segment) for _, track, text, segment in sorted(pending)]
+
+    def adopt_finals(self, finals):
+        """Queue finals taken over from a stopped thread (see pending_finals)"""
+        for track, text, segment in finals:
+            with self.lock:
+                self.seq += 1
+                seq = self.seq
+                self.finalized[track] = max(segment, self.finalized.get(track, -1))
+            self.queue.put((track, text, seq, segment, True), key=('final', track, segment), pinned=True)
+
+    def stop(self, timeout=2.0):
+        """Stop the translation thread, giving up after timeout seconds"""
+        self.running = False
+        self.cancel_current()
+        if not self.wait(int(timeout * 1000)):
+            print("Translation thread did not stop in time")
+
+OVERLAY_HTML = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Subtitle Overlay</title>
+<style>
+  html, body { margin: 0; background: transparent; overflow: hidden; }
+  #tracks { position: absolute; bottom: 24px; width: 100%; text-align: center;
+            font-family: sans-serif; font-size: 36px; font-weight: bold;
+            text-shadow: 0 0 6px #000, 0 0 2px #000; }
+  .track { margin: 4px 0; }
+  .source { opacity: 0.75; font-size: 0.7em; }
+</style>
+</head>
+<body>
+<div id="tracks"></div>
+<script>
+  const colors = __COLORS__;
+  const show = new URLSearchParams(location.search).get("show") || "both";
+  const state = {};
+  function render() {
+    const root = document.getElementById("tracks");
+    root.innerHTML = "";
+    Object.keys(state).sort().forEach(track => {
+      const s = state[track];
+      const line = document.createElement("div");
+      line.className = "track";
+      line.style.color = colors[track % colors.length];
+      const source = s.partial || s.final || "";
+      if (show !== "translation" && source) {
+        const el = document.createElement("div");
+        el.className = show === "both" && s.translation ? "source" : "";
+        el.textContent = source;
+        line.appendChild(el);
+      }
+      if (show !== "source" && s.translation) {
+        const el = document.createElement("div");
+        el.textContent = s.translation;
+        line.appendChild(el);
+      }
+      root.appendChild(line);
+    });
+  }
+  const events = new EventSource("/events");
+  events.onmessage = msg => {
+    const e = JSON.parse(msg.data);
+    const s = state[e.track] = state[e.track] || {};
+    s[e.type] = e.op === "append" ? (s[e.type] || "") + e.text : e.text;
+    if (e.type === "final") s.partial = "";
+    render();
+  };
+</script>
+</body>
+</html>
+"""
+
+class BroadcastClient:
+    """一个订阅字幕事件的连接（SSE 或 WebSocket）
+
+    待发送的事件按 (类型, 轨道) 合并，只保留最新文本；发送时与该连接
+    上次发出的文本比较，只发送增量。
+    """
+
+    def __init__(self, writer, protocol):
+        self.writer = writer
+        self.protocol = protocol  # 'sse' 或 'ws'
+        self.pending = {}  # (type, track) -> 最新文本
+        self.sent = {}  # (type, track) -> 已发送的文本
+        self.wakeup = asyncio.Event()
+
+    def offer(self, kind, track, text):
+        if kind == 'final':
+            # 与页面保持一致：最终转录会清空该轨道的实时转录
+            self.pending.pop(('partial', track), None)
+            self.sent.pop(('partial', track), None)
+        self.pending[(kind, track)] = text
+        self.wakeup.set()
+
+    def encode(self, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        if self.protocol == 'sse':
+            return b"data: " + data + b"\n\n"
+        return websocket_frame(data)
+
+    def take_messages(self):
+        """取出所有待发送的增量消息"""
+        pending, self.pending = self.pending, {}
+        self.wakeup.clear()
+        messages = []
+        for (kind, track), text in pending.items():
+            previous = self.sent.get((kind, track), "")
+            if text == previous:
+                continue
+            if previous and text.startswith(previous):
+                payload = {'type': kind, 'track': track, 'op': 'append', 'text': text[len(previous):]}
+            else:
+                payload = {'type': kind, 'track': track, 'op': 'set', 'text': text}
+            self.sent[(kind, track)] = text
+            messages.append(self.encode(payload))
+        return messages
+
+def websocket_frame(data, opcode=0x1):
+    """编码一个服务端发出的（不加掩码的）WebSocket 帧"""
+    header = bytes([0x80 | opcode])
+    length = len(data)
+    if length < 126:
+        header += bytes([length])
+    elif length < 1 << 16:
+        header += bytes([126]) + length.to_bytes(2, 'big')
+    else:
+        header += bytes([127]) + length.to_bytes(8, 'big')
+    return header + data
+
+class SubtitleBroadcastServer:
+    """内嵌的字幕广播服务
+
+    在独立线程的 asyncio 事件循环中运行，向浏览器源（OBS）、远程观众等
+    推送识别中 / 最终 / 翻译事件：
+      GET /          字幕叠加页面（?show=source|translation|both）
+      GET /events    Server-Sent Events
+      GET /ws        WebSocket
+    publish() 只是把事件交给事件循环，不会阻塞本地字幕的更新。
+    发送缓冲超过 max_buffer 或写入超过 evict_timeout 秒的慢速客户端会被断开。
+    """
+
+    WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+    def __init__(self, host='0.0.0.0', port=8765, max_buffer=256 * 1024, evict_timeout=5.0):
+        self.host = host
+        self.port = port
+        self.max_buffer = max_buffer
+        self.evict_timeout = evict_timeout
+        self.clients = set()
+        self.state = {}  # (type, track) -> 最新文本，新客户端连接时先发送一次
+        self.evicted = 0
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.started = Event()
+
+    def start(self):
+        self.thread = Thread(target=self.run_loop, daemon=True)
+        self.thread.start()
+        self.started.wait(5)
+        if not self.server:
+            raise OSError(f"Broadcast server failed to listen on {self.host}:{self.port}")
+
+    def run_loop(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.server = self.loop.run_until_complete(
+                asyncio.start_server(self.handle_connection, self.host, self.port))
+        except OSError as e:
+            print(f"Failed to start broadcast server: {e}")
+            self.started.set()
+            return
+        self.started.set()
+        self.loop.run_forever()
+        self.loop.close()
+
+    def stop(self):
+        if not self.loop or not self.server:
+            return
+
+        async def shutdown():
+            self.server.close()
+            clients, self.clients = list(self.clients), set()
+            for client in clients:
+                client.writer.transport.abort()
+                client.wakeup.set()
+            # 让连接处理协程自行退出，再停止事件循环
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            if tasks:
+                await asyncio.wait(tasks, timeout=1)
+            self.loop.stop()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self.loop)
+        self.thread.join(2)
+        self.server = None
+
+    def publish(self, kind, track, text):
+        """发布事件（线程安全），kind 为 partial / final / translation"""
+        if self.loop and self.server:
+            self.loop.call_soon_threadsafe(self.broadcast, kind, track, text)
+
+    def broadcast(self, kind, track, text):
+        self.state[(kind, track)] = text
+        if kind == 'final':
+            # 页面收到最终转录时清空实时转录，之后的实时转录要从头发送
+            self.state.pop(('partial', track), None)
+        for client in list(self.clients):
+            transport = client.writer.transport
+            if transport.get_write_buffer_size() > self.max_buffer:
+                self.evict(client)
+            else:
+                client.offer(kind, track, text)
+
+    def evict(self, client):
+        if client in self.clients:
+            self.clients.discard(client)
+            self.evicted += 1
+            client.writer.transport.abort()
+
+    def stats(self):
+        return {'clients': len(self.clients), 'evicted': self.evicted}
+
+    async def handle_connection(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 10)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+        lines = request.decode('latin-1').split("\r\n")
+        parts = lines[0].split()
+        path = parts[1].split('?')[0] if len(parts) > 1 else '/'
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if path == '/events':
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                         b"Cache-Control: no-cache\r\nAccess-Control-Allow-Origin: *\r\n\r\n")
+            await self.serve_client(BroadcastClient(writer, 'sse'), reader)
+        elif path == '/ws' and headers.get('upgrade', '').lower() == 'websocket':
+            accept = base64.b64encode(hashlib.sha1(
+                (headers.get('sec-websocket-key', '') + self.WS_GUID).encode()).digest()).decode()
+            writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n"
+                          f"Connection: Upgrade\r\nSec-WebSocket-Accept: {accept}\r\n\r\n").encode())
+            await self.serve_client(BroadcastClient(writer, 'ws'), reader)
+        elif path in ('/', '/overlay'):
+            body = OVERLAY_HTML.replace('__COLORS__', json.dumps(StyleHelper.TRACK_COLORS)).encode('utf-8')
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/html; charset=utf-8\r\n"
+                         + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+            writer.close()
+        else:
+            writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            await writer.drain()
+            writer.close()
+
+    async def serve_client(self, client, reader):
+        for (kind, track), text in self.state.items():
+            client.offer(kind, track, text)
+        self.clients.add(client)
+        watcher = asyncio.ensure_future(self.watch_client(client, reader))
+        try:
+            while client in self.clients and not watcher.done():
+                await client.wakeup.wait()
+                for message in client.take_messages():
+                    client.writer.write(message)
+                await asyncio.wait_for(client.writer.drain(), self.evict_timeout)
+        except asyncio.TimeoutError:
+            self.evict(client)
+        except (ConnectionError, RuntimeError):
+            pass
+        finally:
+            self.clients.discard(client)
+            watcher.cancel()
+            client.writer.close()
+
+    async def watch_client(self, client, reader):
+        """读取客户端数据：SSE 只用于检测断开，WebSocket 还要处理 ping / close"""
+        try:
+            while True:
+                header = await reader.readexactly(2)
+                if client.protocol == 'sse':
+                    continue
+                opcode, length = header[0] & 0x0F, header[1] & 0x7F
+                if length == 126:
+                    length = int.from_bytes(await reader.readexactly(2), 'big')
+                elif length == 127:
+                    length = int.from_bytes(await reader.readexactly(8), 'big')
+                mask = await reader.readexactly(4) if header[1] & 0x80 else b""
+                payload = await reader.readexactly(length)
+                if mask:
+                    payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+                if opcode == 0x8:
+                    client.writer.write(websocket_frame(payload[:2], 0x8))
+                    break
+                if opcode == 0x9:
+                    client.writer.write(websocket_frame(payload, 0xA))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            client.wakeup.set()
+
+class TranscriptStore:
+    """长时间会话的字幕存储（SQLite + FTS5 全文索引）
+
+    只追加最终转录和翻译。写入通过后台线程批量提交，界面线程只读，
+    WAL 模式下读写互不阻塞。
+    """
+
+    BATCH_SIZE = 500
+
+    def __init__(self, path="transcripts.db"):
+        self.path = path
+        self.queue = BoundedQueue.for_stage('store')
+        self.spilled = 0  # 超出 maxsize 暂存在内存里的写入次数
+        self.failed = 0  # 写入数据库失败而丢失的语句数
+        self.changes_lock = Lock()
+        self.new_rows = False
+        self.updated_ids = set()
+        self.running = True
+        conn = self.connect()
+        self.fts_tokenizer = self.create_schema(conn)
+        conn.close()
+        self.reader = self.connect()  # 只在界面线程使用
+        self.writer = Thread(target=self.write_loop, daemon=True)
+        self.writer.start()
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @staticmethod
+    def create_schema(conn):
+        """建表，返回全文索引使用的分词器（None 表示 SQLite 不支持 FTS5）"""
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                id INTEGER PRIMARY KEY, started REAL, tracks TEXT);
+            CREATE TABLE IF NOT EXISTS segments (
+                id INTEGER PRIMARY KEY, session_id INTEGER, track INTEGER, segment INTEGER,
+                track_name TEXT, created REAL, source TEXT, translation TEXT DEFAULT '',
+                UNIQUE(session_id, track, segment));
+        """)
+        row = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'segments_fts'").fetchone()
+        if row:
+            return 'trigram' if 'trigram' in row[0] else 'unicode61'
+        # trigram 分词可以搜索中日韩文本，旧版 SQLite 退回 unicode61
+        for tokenizer in ('trigram', 'unicode61'):
+            try:
+                conn.executescript(f"""
+                    CREATE VIRTUAL TABLE segments_fts USING fts5(
+                        source, translation, content='segments', content_rowid='id',
+                        tokenize='{tokenizer}');
+                    CREATE TRIGGER segments_ai AFTER INSERT ON segments BEGIN
+                        INSERT INTO segments_fts(rowid, source, translation)
+                        VALUES (new.id, new.source, new.translation);
+                    END;
+                    CREATE TRIGGER segments_au AFTER UPDATE ON segments BEGIN
+                        INSERT INTO segments_fts(segments_fts, rowid, source, translation)
+                        VALUES ('delete', old.id, old.source, old.translation);
+                        INSERT INTO segments_fts(rowid, source, translation)
+                        VALUES (new.id, new.source, new.translation);
+                    END;
+                """)
+                return tokenizer
+            except sqlite3.OperationalError:
+                continue
+        return None
+
+    # 写入（任意线程调用，只是放入队列）
+
+    def put(self, statement):
+        """写入不丢弃：队列满了也接收，只计数并提示数据库跟不上"""
+        if self.queue.qsize() >= self.queue.maxsize:
+            self.spilled += 1
+            if self.spilled == 1 or self.spilled % 1000 == 0:
+                print(f"Transcript store falling behind: {self.queue.qsize()} writes waiting "
+                      f"({self.spilled} over the queue limit so far)")
+        self.queue.put(statement, pinned=True)
+
+    def start_session(self, track_names):
+        session_id = int(time.time() * 1000)
+        self.put(("INSERT OR IGNORE INTO sessions (id, started, tracks) VALUES (?, ?, ?)",
+                  (session_id, time.time(), json.dumps(track_names, ensure_ascii=False))))
+        return session_id
+
+    def add_segment(self, session_id, track, segment, track_name, source):
+        self.put(("INSERT OR IGNORE INTO segments "
+                  "(session_id, track, segment, track_name, created, source) VALUES (?, ?, ?, ?, ?, ?)",
+                  (session_id, track, segment, track_name, time.time(), source)))
+
+    def set_translation(self, session_id, track, segment, translation):
+        self.put(("UPDATE segments SET translation = ? "
+                  "WHERE session_id = ? AND track = ? AND segment = ?",
+                  (translation, session_id, track, segment)))
+
+    def write_loop(self):
+        conn = self.connect()
+        while self.running or self.queue.qsize():
+            try:
+                batch = [self.queue.get(timeout=0.5)]
+            except Empty:
+                continue
+            while len(batch) < self.BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Empty:
+                    break
+            try:
+                new_rows, updated = False, []
+                with conn:
+                    for sql, params in batch:
+                        cursor = conn.execute(sql, params)
+                        if sql.startswith("INSERT OR IGNORE INTO segments"):
+                            new_rows = new_rows or cursor.rowcount > 0
+                        elif sql.startswith("UPDATE segments"):
+                            updated.extend(row[0] for row in conn.execute(
+                                "SELECT id FROM segments WHERE session_id = ? AND track = ? AND segment = ?",
+                                params[1:]))
+                with self.changes_lock:
+                    self.new_rows = self.new_rows or new_rows
+                    self.updated_ids.update(updated)
+            except sqlite3.Error as e:
+                self.failed += len(batch)
+                print(f"Transcript store error: {e} ({self.failed} writes lost so far)")
+        conn.close()
+
+    def take_changes(self):
+        """返回自上次调用以来 (是否有新行, 被更新的行 id)"""
+        with self.changes_lock:
+            changes = (self.new_rows, self.updated_ids)
+            self.new_rows, self.updated_ids = False, set()
+        return changes
+
+    def close(self, timeout=2.0):
+        self.running = False
+        self.writer.join(timeout)
+        self.reader.close()
+
+    # 读取（界面线程）
 
-    def start_resize(self, event):
-        if event.button() == Qt.MouseButton.LeftButton:
-            self.resizing = True
-            self.resize_start_pos = event.globalPosition().toPoint()
-            self.resize_start_size = self.size()
+    FIELDS = ('id', 'session_id', 'track', 'track_name', 'created', 'source', 'translation')
 
-    def do_resize(self, event):
-        if self.resizing:
-            diff = event.globalPosition().toPoint() - self.resize_start_pos
-            new_size = QSize(
-                self.resize_start_size.width() + diff.x(),
-                self.resize_start_size.height() + diff.y()
-            )
-            self.resize(new_size)
+    def fetch(self, query="", before_id=None, after_id=None, limit=200):
+        """按 id 倒序（新的在前）分页读取，query 不为空时做全文搜索"""
+        conditions, params = [], []
+        if before_id is not None:
+            conditions.append("id < ?")
+            params.append(before_id)
+        if after_id is not None:
+            conditions.append("id > ?")
+            params.append(after_id)
+        if query:
+            # trigram 分词至少需要 3 个字符，更短的查询退回 LIKE
+            if self.fts_tokenizer and (self.fts_tokenizer != 'trigram' or len(query) >= 3):
+                # 在索引内按 rowid 倒序取一页，避免先取出全部匹配再排序
+                fts_conditions = [c.replace("id", "rowid", 1) for c in conditions]
+                fts_conditions.append("segments_fts MATCH ?")
+                params.append('"' + query.replace('"', '""') + '"')
+                conditions = [f"id IN (SELECT rowid FROM segments_fts WHERE {' AND '.join(fts_conditions)} "
+                              f"ORDER BY rowid DESC LIMIT ?)"]
+                params.append(limit)
+            else:
+                conditions.append("(source LIKE ? OR translation LIKE ?)")
+                params.extend([f"%{query}%"] * 2)
+        sql = f"SELECT {', '.join(self.FIELDS)} FROM segments"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY id DESC LIMIT ?"
+        params.append(limit)
+        return [dict(zip(self.FIELDS, row)) for row in self.reader.execute(sql, params)]
 
-    def mouseReleaseEvent(self, event):
-        if event.button() == Qt.MouseButton.LeftButton:
-            self.dragging = False
-            self.resizing = False
+    def fetch_ids(self, ids):
+        placeholders = ",".join("?" * len(ids))
+        rows = self.reader.execute(
+            f"SELECT {', '.join(self.FIELDS)} FROM segments WHERE id IN ({placeholders})", list(ids))
+        return {row[0]: dict(zip(self.FIELDS, row)) for row in rows}
 
-    def resizeEvent(self, event):
-        super().resizeEvent(event)
-        # 更新调整大小控件的位置
-        self.resize_handle.move(
-            self.width() - self.resize_handle.width() - 5,
-            self.height() - self.resize_handle.height() - 5
-        )
-        # 更新设置按钮的位置
-        self.settings_button.move(5, 5)
+class TranscriptListModel(QAbstractListModel):
+    """历史字幕列表模型：按需分页加载（新的在前），十万条以上也只在内存中保留已滚动到的部分"""
 
-class STTThread(QThread):
-    text_signal = pyqtSignal(str)
-    model_ready_signal = pyqtSignal()
+    PAGE_SIZE = 200
 
-    def __init__(self, config):
+    def __init__(self, store):
         super().__init__()
-        # 添加实时转录相关配置
-        self.config = config.copy()
-        self.config.update({
-            'on_realtime_transcription_update': self.process_text  # 实时转录回调
-        })
-        self.running = True
-        self.recorder = None
-        self.paused = True
-        self.last_text = ""
+        self.store = store
+        self.query = ""
+        self.rows = []
+        self.row_of_id = {}
+        self.exhausted = False
+        self.reload()
 
-    def run(self):
-        try:
-            if not self.recorder:
-                # 创建录音器
-                self.recorder = AudioToTextRecorder(**self.config)
-                
-                # 等待 recorder.is_running 变为 True
-                while not self.recorder.is_running:
-                    if not self.running:
-                        return
-                    self.msleep(100)
-                
-                # 发送模型就绪信号
-                self.model_ready_signal.emit()
+    def reload(self):
+        self.beginResetModel()
+        self.rows = []
+        self.row_of_id = {}
+        self.exhausted = False
+        self.endResetModel()
+        self.fetchMore(QModelIndex())
 
-            # 开始录音和识别循环
-            while self.running:
-                if not self.paused:
-                    # 不再需要传递回调函数，因为已经在配置中设置了
-                    self.recorder.text()
-                else:
-                    self.msleep(100)
-                
-        except Exception as e:
-            print(f"Error in STT Thread: {e}")
+    def set_query(self, query):
+        self.query = query.strip()
+        self.reload()
 
-    def process_text(self, text):
-        """处理实时转录的文本"""
-        if not self.running or self.paused:
-             return
-        if text != self.last_text and self.running:
-            self.last_text = text
-            # 发送文本用于显示
-            if text:
-                self.text_signal.emit(text)
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
 
-    def pause(self):
-        """暂停录音"""
-        if self.recorder:
-            self.paused = True
-            self.recorder.stop()
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or role != Qt.ItemDataRole.DisplayRole:
+            return None
+        row = self.rows[index.row()]
+        text = f"{time.strftime('%m-%d %H:%M:%S', time.localtime(row['created']))}  [{row['track_name']}] {row['source']}"
+        if row['translation']:
+            text += f"  →  {row['translation']}"  # 单行显示，配合 setUniformItemSizes
+        return text
 
-    def resume(self):
-        """恢复录音"""
-        self.paused = False
+    def canFetchMore(self, parent):
+        return not parent.isValid() and not self.exhausted
 
-    def stop(self):
-        """停止线程"""
-        self.running = False
-        if self.recorder:
-            self.recorder.stop()
-        self.wait()
+    def fetchMore(self, parent):
+        if parent.isValid() or self.exhausted:
+            return
+        before_id = self.rows[-1]['id'] if self.rows else None
+        records = self.store.fetch(self.query, before_id=before_id, limit=self.PAGE_SIZE)
+        if len(records) < self.PAGE_SIZE:
+            self.exhausted = True
+        if records:
+            start = len(self.rows)
+            self.beginInsertRows(QModelIndex(), start, start + len(records) - 1)
+            for i, record in enumerate(records):
+                self.row_of_id[record['id']] = start + i
+            self.rows.extend(records)
+            self.endInsertRows()
 
-class TranslateThread(QThread):
-    translation_signal = pyqtSignal(str)
-    
-    def __init__(self, model_name, target_lang):
-        super().__init__()
-        self.translation_threshold = 0.8  # Translation threshold to prevent overload
-        self.model_name = model_name
-        self.target_lang = target_lang
-        self.queue = Queue()
-        self.running = True
-        self.last_translation_time = 0
-        
-    def run(self):
-        while self.running:
-            try:
-                text = self.queue.get(timeout=0.5)
-                if text:
-                    # Check if enough time has passed since last translation
-                    current_time = time.time()
-                    if current_time - self.last_translation_time >= self.translation_threshold:
-                        self.translate_text(text)
-                        self.last_translation_time = current_time
-            except Empty:
-                continue
-                
-    def translate_text(self, text):
-        try:
-            prompt = f"""Translate the following text to {self.target_lang}.
-Only output the translation, no explanations.
+    def apply_changes(self):
+        """把后台线程新提交的数据反映到列表中"""
+        new_rows, updated_ids = self.store.take_changes()
+        if new_rows:
+            after_id = self.rows[0]['id'] if self.rows else 0
+            records = self.store.fetch(self.query, after_id=after_id, limit=10000)
+            if records:
+                self.beginInsertRows(QModelIndex(), 0, len(records) - 1)
+                self.rows[:0] = records
+                self.row_of_id = {record['id']: i for i, record in enumerate(self.rows)}
+                self.endInsertRows()
+        updated_ids = [i for i in updated_ids if i in self.row_of_id]
+        if updated_ids:
+            for record_id, record in self.store.fetch_ids(updated_ids).items():
+                row = self.row_of_id[record_id]
+                self.rows[row] = record
+                index = self.index(row)
+                self.dataChanged.emit(index, index)
 
-Text to translate: {text}"""
-            
-            # Use streaming generation for translation
-            stream = ollama.Client().generate(
-                model=self.model_name,
-                prompt=prompt,
-                stream=True
-            )
-            
-            translated_text = ""
-            for chunk in stream:
-                if not self.running:
-                    break
-                if "response" in chunk:
-                    translated_text += chunk["response"]
-                    self.translation_signal.emit(translated_text)
-                    
+class Supervisor:
+    """看门狗：组件故障或卡死时按指数退避重启
+
+    由界面定时器调用 report()。第一次故障立即重启，之后在退避时间内的故障
+    先挂起，等到时间再重启；组件正常运行 healthy_reset 秒后退避清零。
+    恢复事件保留在内存中供界面显示，同时追加到 JSONL 日志。
+    """
+
+    def __init__(self, base_delay=1.0, max_delay=60.0, healthy_reset=60.0, log_path="logs/recovery.jsonl"):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.healthy_reset = healthy_reset
+        self.log_path = log_path
+        self.components = {}  # 组件名 -> 故障/重启计数与退避状态
+        self.events = deque(maxlen=50)
+
+    def report(self, name, reason, restart):
+        """报告组件故障，到了退避时间就调用 restart()，返回是否重启了"""
+        now = time.time()
+        state = self.components.setdefault(
+            name, {'failures': 0, 'restarts': 0, 'last_failure': None, 'next_restart': 0.0})
+        if now < state['next_restart']:
+            return False
+        if state['last_failure'] and now - state['last_failure'] > self.healthy_reset:
+            state['failures'] = 0
+        state['failures'] += 1
+        state['restarts'] += 1
+        state['last_failure'] = now
+        state['next_restart'] = now + min(self.max_delay, self.base_delay * 2 ** (state['failures'] - 1))
+        event = {'time': round(now, 3), 'component': name, 'reason': reason, 'attempt': state['failures']}
+        try:
+            restart()
+            event['result'] = 'restarted'
         except Exception as e:
-            print(f"Translation error: {e}")
-            
-    def add_text(self, text):
-        """Add text to the translation queue"""
-        self.queue.put(text)
-        
-    def stop(self):
-        """Stop the translation thread"""
-        self.running = False
-        self.wait()
+            event['result'] = f"restart failed: {e}"
+        print(f"Watchdog: {name} {reason} -> {event['result']}")
+        self.events.append(event)
+        try:
+            os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(event, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"Recovery log error: {e}")
+        return True
+
+    def stats(self):
+        return {name: state['restarts'] for name, state in self.components.items()}
 
 class MainWindow(QMainWindow):
     
@@ -563,6 +3046,8 @@ class MainWindow(QMainWindow):
         
         # 初始化 Ollama 客户端
         self.translation_thread = None
+        self.translation_clock = None  # 翻译线程使用的回放时钟（实时识别时为 None）
+        self.pending_finals = []  # 停止的翻译线程没翻译完的最终转录，交给下一个线程
         self.translation_running = False
 
         
@@ -615,12 +3100,33 @@ class MainWindow(QMainWindow):
         mic_layout.addWidget(self.mic_combo)
         basic_layout.addLayout(mic_layout)
 
+        # 附加音源（可同时识别多个设备，例如麦克风 + 游戏/嘉宾回放）
+        source_label = QLabel("附加音源:")
+        source_label.setStyleSheet(f"color: {StyleHelper.TEXT};")
+        self.source_list = QListWidget()
+        for device in input_devices:
+            item = QListWidgetItem(device)
+            item.setFlags(item.flags() | Qt.ItemFlag.ItemIsUserCheckable)
+            item.setCheckState(Qt.CheckState.Unchecked)
+            self.source_list.addItem(item)
+        self.source_list.setStyleSheet(f"""
+            QListWidget {{
+                background-color: rgba(255, 255, 255, 0.1);
+                color: {StyleHelper.TEXT};
+                border: 1px solid rgba(255, 255, 255, 0.2);
+                border-radius: 8px;
+            }}
+        """)
+        self.source_list.setMaximumHeight(90)
+        basic_layout.addWidget(source_label)
+        basic_layout.addWidget(self.source_list)
+
         # 语言选择
         lang_layout = QHBoxLayout()
         lang_label = QLabel("识别语言:")
         lang_label.setStyleSheet(f"color: {StyleHelper.TEXT};")
         self.language_combo = QComboBox()
-        self.language_combo.addItems(["en", "zh", "ja", "ko", "de", "fr"])
+        self.language_combo.addItems(["en", "zh", "ja", "ko", "de", "fr", "auto"])  # auto: 自动检测
         self.language_combo.setStyleSheet(StyleHelper.get_combo_style())
         lang_layout.addWidget(lang_label)
         lang_layout.addWidget(self.language_combo)
@@ -638,6 +3144,40 @@ class MainWindow(QMainWindow):
         model_layout.addWidget(self.model_combo)
         basic_layout.addLayout(model_layout)
 
+        # 实时模型（与主模型相同时共享同一份权重）
+        realtime_model_layout = QHBoxLayout()
+        realtime_model_label = QLabel("实时模型:")
+        realtime_model_label.setStyleSheet(f"color: {StyleHelper.TEXT};")
+        self.realtime_model_combo = QComboBox()
+        self.realtime_model_combo.addItems(["tiny", "tiny.en", "base", "base.en", "small", "与主模型相同"])
+        self.realtime_model_combo.setStyleSheet(StyleHelper.get_combo_style())
+        realtime_model_layout.addWidget(realtime_model_label)
+        realtime_model_layout.addWidget(self.realtime_model_combo)
+        basic_layout.addLayout(realtime_model_layout)
+
+        # 计算精度（自动：CPU 上使用 int8 量化）
+        compute_type_layout = QHBoxLayout()
+        compute_type_label = QLabel("计算精度:")
+        compute_type_label.setStyleSheet(f"color: {StyleHelper.TEXT};")
+        self.compute_type_combo = QComboBox()
+        self.compute_type_combo.addItems(["auto", "int8", "int8_float16", "float16", "float32"])
+        self.compute_type_combo.setStyleSheet(StyleHelper.get_combo_style())
+        compute_type_layout.addWidget(compute_type_label)
+        compute_type_layout.addWidget(self.compute_type_combo)
+        basic_layout.addLayout(compute_type_layout)
+
+        # 识别后端（模拟后端不需要模型和音频设备，用于压测）
+        backend_layout = QHBoxLayout()
+        backend_label = QLabel("识别后端:")
+        backend_label.setStyleSheet(f"color: {StyleHelper.TEXT};")
+        self.backend_combo = QComboBox()
+        for label, backend in (("RealtimeSTT", "realtimestt"), ("faster-whisper", "faster-whisper"), ("模拟", "mock")):
+            self.backend_combo.addItem(label, backend)
+        self.backend_combo.setStyleSheet(StyleHelper.get_combo_style())
+        backend_layout.addWidget(backend_label)
+        backend_layout.addWidget(self.backend_combo)
+        basic_layout.addLayout(backend_layout)
+
         # 在基础设置组中添加唤醒词设置
         wake_word_layout = QHBoxLayout()
         wake_word_label = QLabel("唤醒词:")
@@ -696,6 +3236,43 @@ class MainWindow(QMainWindow):
         target_lang_layout.addWidget(self.target_lang_combo)
         translate_layout.addLayout(target_lang_layout)
 
+        # 术语表（专有名词固定译法，修改文件后自动重新加载）
+        glossary_layout = QHBoxLayout()
+        glossary_label = QLabel("术语表:")
+        glossary_label.setStyleSheet(f"color: {StyleHelper.TEXT};")
+        self.glossary = Glossary()
+        self.glossary_button = QPushButton("选择文件")
+        self.glossary_button.setStyleSheet(StyleHelper.get_button_style())
+        self.glossary_button.clicked.connect(self.choose_glossary)
+        glossary_layout.addWidget(glossary_label)
+        glossary_layout.addWidget(self.glossary_button)
+        translate_layout.addLayout(glossary_layout)
+
+        # 备用翻译（Ollama 排队延迟超过预算时先显示本地翻译，LLM 结果到达后替换）
+        fallback_layout = QHBoxLayout()
+        fallback_label = QLabel("备用翻译:")
+        fallback_label.setStyleSheet(f"color: {StyleHelper.TEXT};")
+        self.fallback_combo = QComboBox()
+        self.fallback_combo.addItems(["无", "术语表", "CTranslate2"])
+        self.fallback_combo.setStyleSheet(StyleHelper.get_combo_style())
+        self.fallback_combo.textActivated.connect(self.choose_fallback)
+        self.ct2_model_dir = None
+        fallback_layout.addWidget(fallback_label)
+        fallback_layout.addWidget(self.fallback_combo)
+        translate_layout.addLayout(fallback_layout)
+
+        budget_layout = QHBoxLayout()
+        budget_label = QLabel("延迟预算(秒):")
+        budget_label.setStyleSheet(f"color: {StyleHelper.TEXT};")
+        self.latency_budget = QDoubleSpinBox()
+        self.latency_budget.setRange(0.2, 10)
+        self.latency_budget.setSingleStep(0.1)
+        self.latency_budget.setValue(1.5)
+        self.latency_budget.setStyleSheet(StyleHelper.get_spinbox_style())
+        budget_layout.addWidget(budget_label)
+        budget_layout.addWidget(self.latency_budget)
+        translate_layout.addLayout(budget_layout)
+
         settings_layout.addWidget(translate_group)
 
         left_layout.addWidget(settings_card)  # 将设置卡片添加到内容布局
@@ -725,6 +3302,17 @@ class MainWindow(QMainWindow):
         model_buttons_layout.addWidget(self.unload_model_button)
         
         model_control_layout.addLayout(model_buttons_layout)
+
+        # 会话录制 / 回放（用于离线复现延迟和识别问题）
+        session_layout = QHBoxLayout()
+        self.record_session = QCheckBox("录制会话")
+        self.record_session.setStyleSheet(StyleHelper.get_checkbox_style())
+        self.replay_button = QPushButton("回放会话")
+        self.replay_button.setStyleSheet(StyleHelper.get_button_style())
+        self.replay_button.clicked.connect(self.load_replay)
+        session_layout.addWidget(self.record_session)
+        session_layout.addWidget(self.replay_button)
+        model_control_layout.addLayout(session_layout)
         right_layout.addWidget(model_control_group)
 
         # VAD 设置组
@@ -781,9 +3369,64 @@ class MainWindow(QMainWindow):
         self.output_text.setWordWrap(True)
         self.output_text.setAlignment(Qt.AlignmentFlag.AlignTop | Qt.AlignmentFlag.AlignLeft)
         output_layout.addWidget(self.output_text)
+
+        # 流水线队列状态（深度 / 丢弃数量）
+        self.pipeline_stats_label = QLabel()
+        self.pipeline_stats_label.setStyleSheet(f"color: {StyleHelper.SUBTEXT}; font-size: 12px;")
+        output_layout.addWidget(self.pipeline_stats_label)
         
         right_layout.addWidget(output_group)  # 添加到右侧布局中
 
+        # 历史记录：所有会话的最终字幕，支持全文搜索
+        history_group = QGroupBox("历史记录")
+        history_group.setStyleSheet(StyleHelper.get_group_box_style())
+        history_layout = QVBoxLayout(history_group)
+        self.history_search = QLineEdit()
+        self.history_search.setPlaceholderText("搜索所有会话...")
+        self.history_search.setStyleSheet("""
+            QLineEdit {
+                background-color: rgba(255, 255, 255, 0.1);
+                color: white;
+                border: 1px solid rgba(255, 255, 255, 0.2);
+                border-radius: 8px;
+                padding: 8px 12px;
+            }
+        """)
+        self.history_search.textChanged.connect(lambda: self.search_timer.start(300))
+        history_layout.addWidget(self.history_search)
+        # 数据库打不开（目录只读、文件被锁）时只停用历史记录，不影响识别和翻译
+        try:
+            self.transcript_store = TranscriptStore()
+        except (sqlite3.Error, OSError) as e:
+            print(f"Transcript history disabled: {e}")
+            self.transcript_store = None
+        self.history_model = TranscriptListModel(self.transcript_store) if self.transcript_store else None
+        self.history_view = QListView()
+        if self.history_model:
+            self.history_view.setModel(self.history_model)
+        else:
+            history_group.setTitle("历史记录（不可用）")
+            history_group.setEnabled(False)
+            self.history_search.setPlaceholderText("无法打开历史记录数据库")
+        self.history_view.setUniformItemSizes(True)  # 大量行时不逐行计算高度
+        self.history_view.setWordWrap(False)
+        self.history_view.setStyleSheet(f"""
+            QListView {{
+                color: {StyleHelper.TEXT};
+                background-color: rgba(0, 0, 0, 0.2);
+                border-radius: 8px;
+                padding: 4px;
+            }}
+        """)
+        self.history_view.setMinimumHeight(160)
+        history_layout.addWidget(self.history_view)
+        self.search_timer = QTimer()
+        self.search_timer.setSingleShot(True)
+        self.search_timer.timeout.connect(lambda: self.history_model.set_query(self.history_search.text()))
+        self.transcript_session = None
+
+        right_layout.addWidget(history_group)
+
         # 添加开始/停止按钮和字幕按钮
         control_group = QGroupBox("控制")
         control_group.setStyleSheet(StyleHelper.get_group_box_style())
@@ -804,6 +3447,22 @@ class MainWindow(QMainWindow):
         button_layout.addWidget(self.subtitle_button)
 
         control_layout.addLayout(button_layout)
+
+        # 字幕广播（OBS 浏览器源 / 远程观众 / 第二显示器）
+        broadcast_layout = QHBoxLayout()
+        self.enable_broadcast = QCheckBox("启用字幕广播")
+        self.enable_broadcast.setStyleSheet(StyleHelper.get_checkbox_style())
+        self.enable_broadcast.toggled.connect(self.toggle_broadcast)
+        self.broadcast_port = QSpinBox()
+        self.broadcast_port.setRange(1024, 65535)
+        self.broadcast_port.setValue(8765)
+        self.broadcast_label = QLabel()
+        self.broadcast_label.setStyleSheet(f"color: {StyleHelper.SUBTEXT}; font-size: 12px;")
+        self.broadcast_label.setTextInteractionFlags(Qt.TextInteractionFlag.TextSelectableByMouse)
+        broadcast_layout.addWidget(self.enable_broadcast)
+        broadcast_layout.addWidget(self.broadcast_port)
+        control_layout.addLayout(broadcast_layout)
+        control_layout.addWidget(self.broadcast_label)
         right_layout.addWidget(control_group)
 
         main_layout.addLayout(right_layout)  # 添加右侧布局
@@ -814,68 +3473,322 @@ class MainWindow(QMainWindow):
 
         # 初始化字幕窗口和STT线程
         self.subtitle_window = SubtitleWindow()
-        self.stt_thread = None
+        self.stt_threads = []  # 每个音源一个识别线程
+        self.inference_pool = None
+        self.track_names = []
+        self.track_texts = {}
+        # 每个音源当前句子的编号，最终转录后加一。跨会话继续递增不清零：翻译线程
+        # 在卸载/重新加载后仍然存在，它按 (音源, 编号) 缓存的状态不能和新会话混淆
+        self.segment_ids = {}
+        self.segment_sessions = {}  # (音源, 编号) -> 历史记录会话，等待最终翻译的句子
+        self.ready_count = 0
         self.is_recording = False
         self.subtitle_visible = False
         self.model_loaded = False
         self.loading_timer = QTimer()  # 添加定时器
         self.loading_timer.timeout.connect(self.handle_loading_timeout)
         self.loading_timer.setSingleShot(True)  # 设置为单次触发
+        self.broadcast_server = None
+        self.session_recorder = None
+        self.replay_clock = None
+        self.translation_metrics = TranslationMetrics()
+        self.supervisor = Supervisor()
+        self.abandoned_threads = []  # 被看门狗替换、可能仍卡在录音器里的线程，保留引用直到退出
+        self.stats_timer = QTimer()
+        self.stats_timer.timeout.connect(self.update_pipeline_stats)
+        self.stats_timer.start(1000)
 
-    def start_translation_thread(self):
-        """Start the translation thread"""
+    def pipeline_stats(self):
+        """收集各级队列的深度和丢弃数量"""
+        stats = []
+        if self.inference_pool:
+            stats.append(self.inference_pool.stats())
+        stats.extend(thread.outbox.stats() for thread in self.stt_threads)
+        if self.translation_thread:
+            stats.extend(self.translation_thread.queue_stats())
+        return stats
+
+    def update_pipeline_stats(self):
+        totals = {}
+        for stat in self.pipeline_stats():
+            total = totals.setdefault(stat['name'], {'depth': 0, 'maxsize': 0, 'dropped': 0})
+            for field in total:
+                total[field] += stat[field]
+        names = {'inference': "推理", 'stt_ui': "识别显示", 'translate': "翻译", 'translation_ui': "翻译显示"}
+        text = "  ".join(
+            f"{names.get(name, name)} {t['depth']}/{t['maxsize']} 丢弃 {t['dropped']}"
+            for name, t in totals.items())
+        models = "  ".join(
+            f"{m['model']}({m['device']}, {m['compute_type']}) ×{m['refs']}"
+            + (" 加载中" if m['loading'] else "")
+            + (f" ≈{m['memory_mb']:.0f}MB" if m['memory_mb'] is not None else "")
+            for m in MODEL_REGISTRY.stats())
+        if models:
+            text = f"{text}\n模型: {models}" if text else f"模型: {models}"
+        usage = self.translation_metrics.summary()
+        if usage['requests']:
+            line = (f"Ollama: {usage['requests']} 次请求 失败 {usage['failures']}"
+                    + (f"  {usage['tokens_per_sec']:.0f} tok/s" if usage['tokens_per_sec'] else "")
+                    + (f"  首字 p50 {usage['ttft_p50']:.0f}ms p95 {usage['ttft_p95']:.0f}ms"
+                       if usage['ttft_p50'] is not None else "")
+                    + (f"  提示 {usage['prompt_tokens']:.0f} tok" if usage['prompt_tokens'] else "")
+                    + f"  模型加载 {usage['load_events']} 次"
+                    + (f" (最近 {time.strftime('%H:%M:%S', time.localtime(usage['last_load'][0]))}, "
+                       f"{'≥' if usage['last_load'][2] else ''}{usage['last_load'][1]:.1f}s)"
+                       if usage['last_load'] else ""))
+            text = f"{text}\n{line}" if text else line
+        translator = self.translation_thread
+        if translator and translator.consecutive_errors:
+            wait = max(0.0, translator.backoff_until - time.time())
+            line = f"翻译失败 {translator.consecutive_errors} 次，{wait:.0f}s 后重试: {translator.last_error}"
+            text = f"{text}\n{line}" if text else line
+        if self.language_combo.currentText() == "auto" and self.track_names:
+            languages = "  ".join(f"{name}={self.source_language(i) or '?'}" for i, name in enumerate(self.track_names))
+            skipped = self.translation_thread.skipped if self.translation_thread else 0
+            line = f"语言: {languages}  跳过翻译 {skipped}"
+            text = f"{text}\n{line}" if text else line
+        if self.supervisor.events:
+            event = self.supervisor.events[-1]
+            restarts = "  ".join(f"{name} ×{count}" for name, count in self.supervisor.stats().items())
+            line = (f"恢复: {restarts}  最近 {time.strftime('%H:%M:%S', time.localtime(event['time']))} "
+                    f"{event['component']} {event['reason']}")
+            text = f"{text}\n{line}" if text else line
+        self.pipeline_stats_label.setText(text)
+        if self.history_model:
+            self.history_model.apply_changes()
+        self.supervise()
+
+    def supervise(self):
+        """看门狗：检查识别和翻译线程，故障或卡死时重启（模型仍在推理池中，是热重启）"""
+        now = time.time()
+        if self.model_loaded and self.replay_clock is None:
+            for track, thread in enumerate(self.stt_threads):
+                reason = thread.stall_reason(now)
+                if reason:
+                    self.supervisor.report(f"识别[{self.track_names[track]}]", reason,
+                                           lambda track=track: self.restart_stt_thread(track))
+        if self.translation_thread:
+            reason = self.translation_thread.stall_reason(now)
+            if reason:
+                self.supervisor.report("翻译", reason, self.restart_translation_thread)
+
+    def restart_stt_thread(self, track):
+        old = self.stt_threads[track]
+        old.running = False
+        old.paused = True
+        if old.recorder:
+            # 卡住的录音器可能关不掉，不让它阻塞界面
+            Thread(target=old.recorder.shutdown, daemon=True).start()
+        self.abandoned_threads.append(old)
+        thread = STTThread(old.config, track, self.inference_pool)
+        thread.session_recorder = old.session_recorder
+        thread.text_signal.connect(self.update_subtitle)
+        thread.final_signal.connect(self.on_final_text)
+        thread.error_signal.connect(lambda *_: self.supervise())
+        thread.model_ready_signal.connect(lambda: thread.resume() if self.is_recording else None)
+        self.stt_threads[track] = thread
+        thread.start()
+
+    def restart_translation_thread(self):
+        clock = self.translation_clock
+        self.stop_translation_thread()
+        self.start_translation_thread(clock)
+
+    def start_translation_thread(self, clock=None):
+        """Start the translation thread
+
+        An existing thread running on another clock (live vs. replay) is
+        replaced; finals it had not translated yet move to the new thread.
+        """
+        if self.translation_thread and clock is not self.translation_clock:
+            self.stop_translation_thread()
         if self.translation_thread is None:
+            self.translation_clock = clock
             self.translation_thread = TranslateThread(
-                self.ollama_model_combo.currentText(),
-                self.target_lang_combo.currentText()
+                OllamaTranslator(self.ollama_model_combo.currentText(), metrics=self.translation_metrics),
+                self.target_lang_combo.currentText(),
+                self.glossary,
+                self.create_fallback_translator(),
+                self.latency_budget.value(),
+                clock
             )
             self.translation_thread.translation_signal.connect(self.update_translation_ui)
+            self.translation_thread.final_translation_signal.connect(self.on_final_translation)
+            self.translation_thread.session_recorder = self.session_recorder
+            self.translation_thread.adopt_finals(self.pending_finals)
+            self.pending_finals = []
             self.translation_thread.start()
 
+    def choose_glossary(self):
+        path, _ = QFileDialog.getOpenFileName(self, "选择术语表", "", "Glossary (*.txt *.tsv);;All Files (*)")
+        if path:
+            self.glossary.path = path
+            self.glossary.reload_async()
+            self.glossary_button.setText(os.path.basename(path))
+
+    def choose_fallback(self, kind):
+        if kind == "CTranslate2":
+            path = QFileDialog.getExistingDirectory(self, "选择 CTranslate2 模型目录")
+            if path:
+                self.ct2_model_dir = path
+            elif not self.ct2_model_dir:
+                self.fallback_combo.setCurrentText("无")
+
+    def create_fallback_translator(self):
+        kind = self.fallback_combo.currentText()
+        if kind == "术语表":
+            return GlossaryTranslator(self.glossary)
+        if kind == "CTranslate2" and self.ct2_model_dir:
+            return CTranslate2Translator(self.ct2_model_dir)
+        return None
+
     def stop_translation_thread(self):
-        """Stop the translation thread"""
+        """Stop the translation thread, keeping its untranslated finals for the next one"""
         if self.translation_thread:
             self.translation_thread.stop()
+            self.pending_finals.extend(self.translation_thread.pending_finals())
             self.translation_thread = None
 
-    def update_translation_ui(self, text):
-        if self.enable_translate.isChecked():
-            # 更新主窗口的输出文本
+    def show_track_text(self, track, text):
+        """更新某个音源的输出文本，多音源时按轨道逐行显示"""
+        self.track_texts[track] = text
+        if self.session_recorder:
+            self.session_recorder.record_event('ui', track, text)
+        if len(self.track_names) > 1:
+            self.output_text.setText('\n'.join(
+                f"[{self.track_names[t]}] {self.track_texts[t]}" for t in sorted(self.track_texts)))
+        else:
             self.output_text.setText(text)
-            # 如果字幕窗口可见，也更新字幕
-            if self.subtitle_visible:
-                self.subtitle_window.update_text(text)
+        # 如果字幕窗口可见，也更新字幕
+        if self.subtitle_visible:
+            self.subtitle_window.update_text(text, track)
+
+    def update_translation_ui(self, track):
+        text = self.translation_thread.take_translation(track) if self.translation_thread else None
+        if text is not None and self.enable_translate.isChecked():
+            self.show_track_text(track, text)
+            self.publish('translation', track, text)
+
+    def on_final_text(self, track, text):
+        segment = self.segment_ids.get(track, 0)
+        self.segment_ids[track] = segment + 1
+        translate = self.enable_translate.isChecked() and self.translation_thread
+        language = self.source_language(track)
+        # 先写历史记录：复用推测翻译时 add_final 会立即发出最终翻译
+        if self.transcript_session is not None:
+            self.transcript_store.add_segment(
+                self.transcript_session, track, segment, self.track_names[track], text)
+            if translate and language != self.translation_thread.target_lang:
+                self.segment_sessions[(track, segment)] = self.transcript_session
+                if len(self.segment_sessions) > 10000:  # 翻译线程重启时丢失的句子不会再有结果
+                    del self.segment_sessions[next(iter(self.segment_sessions))]
+        if translate:
+            self.translation_thread.add_final(text, track, segment, language)
+        self.publish('final', track, text)
+
+    def source_language(self, track):
+        """音源的识别语言，自动检测模式下为检测到的会话语言（未知时为 None）"""
+        language = self.language_combo.currentText()
+        if language != "auto":
+            return language
+        return self.inference_pool.language(track) if self.inference_pool else None
+
+    def on_final_translation(self, track, segment, text):
+        # 上一个会话的句子可能在新会话开始后才翻译完，写回它自己的会话
+        session = self.segment_sessions.pop((track, segment), None)
+        if session is not None:
+            self.transcript_store.set_translation(session, track, segment, text)
+
+    def publish(self, kind, track, text):
+        """把事件推送给广播客户端（本地字幕更新之后调用，不阻塞界面）"""
+        if self.broadcast_server:
+            self.broadcast_server.publish(kind, track, text)
+
+    def toggle_broadcast(self, enabled):
+        if enabled and not self.broadcast_server:
+            server = SubtitleBroadcastServer(port=self.broadcast_port.value())
+            try:
+                server.start()
+            except OSError as e:
+                QMessageBox.critical(self, "错误", f"字幕广播启动失败: {e}")
+                self.enable_broadcast.setChecked(False)
+                return
+            self.broadcast_server = server
+            self.broadcast_port.setEnabled(False)
+            self.broadcast_label.setText(f"叠加页面: http://localhost:{server.port}/")
+        elif not enabled and self.broadcast_server:
+            self.broadcast_server.stop()
+            self.broadcast_server = None
+            self.broadcast_port.setEnabled(True)
+            self.broadcast_label.setText("")
     def toggle_recording(self):
         if not self.model_loaded:
             print("请先加载模型")
             return
             
         if not self.is_recording:
-            self.stt_thread.resume()
+            self.start_session_recording()
+            if self.replay_clock:
+                self.replay_clock.start()
+            for thread in self.stt_threads:
+                thread.resume()
             self.start_button.setText("停止识别")
             self.is_recording = True
             
             # 禁用设置控件
             self.mic_combo.setEnabled(False)
+            self.source_list.setEnabled(False)
             self.language_combo.setEnabled(False)
             self.model_combo.setEnabled(False)
+            self.realtime_model_combo.setEnabled(False)
+            self.compute_type_combo.setEnabled(False)
+            self.backend_combo.setEnabled(False)
             self.silero_sensitivity.setEnabled(False)
             self.silero_onnx.setEnabled(False)
             self.load_model_button.setEnabled(False)
             self.unload_model_button.setEnabled(False)
         else:
-            self.stt_thread.pause()
+            if self.replay_clock:
+                self.replay_clock.pause()
+            for thread in self.stt_threads:
+                thread.pause()
+            self.stop_session_recording()
             self.start_button.setText("开始识别")
             self.is_recording = False
             
             # 启用设置控件
             self.mic_combo.setEnabled(True)
+            self.source_list.setEnabled(True)
             self.language_combo.setEnabled(True)
             self.model_combo.setEnabled(True)
+            self.realtime_model_combo.setEnabled(True)
+            self.compute_type_combo.setEnabled(True)
+            self.backend_combo.setEnabled(True)
             self.silero_sensitivity.setEnabled(True)
             self.silero_onnx.setEnabled(True)
             self.unload_model_button.setEnabled(True)
 
+    def set_session_recorder(self, recorder):
+        for thread in self.stt_threads:
+            thread.session_recorder = recorder
+        if self.translation_thread:
+            self.translation_thread.session_recorder = recorder
+
+    def start_session_recording(self):
+        if self.record_session.isChecked() and not self.session_recorder:
+            try:
+                self.session_recorder = SessionRecorder("recordings", self.track_names)
+            except OSError as e:
+                print(f"Failed to start session recording: {e}")
+                return
+            self.set_session_recorder(self.session_recorder)
+
+    def stop_session_recording(self):
+        if self.session_recorder:
+            self.set_session_recorder(None)
+            self.session_recorder.close()
+            self.session_recorder = None
+
     def toggle_subtitle(self):
         if not self.subtitle_visible:
             self.subtitle_window.show()
@@ -888,74 +3801,176 @@ class MainWindow(QMainWindow):
 
     def closeEvent(self, event):
         self.stop_translation_thread()  # 停止翻译线程
-        if self.stt_thread:
-            self.stt_thread.stop()  # 完全停止并清理
-            self.stt_thread = None
+        self.stop_session_recording()
+        self.stop_stt_threads()  # 完全停止并清理
+        if self.broadcast_server:
+            self.broadcast_server.stop()
+        if self.transcript_store:
+            self.transcript_store.close()
+        self.translation_metrics.close()
         self.pa.terminate()
         event.accept()
 
+    def selected_sources(self):
+        """返回 [(设备序号, 名称)]，主麦克风在前，附加音源按列表顺序"""
+        sources = [self.mic_combo.currentText()]
+        for i in range(self.source_list.count()):
+            item = self.source_list.item(i)
+            if item.checkState() == Qt.CheckState.Checked and item.text() not in sources:
+                sources.append(item.text())
+        return [(int(text.split(':')[0]), text.split(':', 1)[1].strip()) for text in sources]
+
+    def stop_stt_threads(self):
+        for thread in self.stt_threads:
+            thread.stop()
+        self.stt_threads = []
+        if self.inference_pool:
+            self.inference_pool.shutdown()
+            self.inference_pool = None
+
+    def realtime_model_name(self):
+        realtime_model = self.realtime_model_combo.currentText()
+        return self.model_combo.currentText() if realtime_model == "与主模型相同" else realtime_model
+
+    def create_inference_pool(self):
+        if self.backend_combo.currentData() == MockTranscriber.name:
+            return None  # 模拟后端不加载模型
+        return SharedInferencePool(
+            self.model_combo.currentText(), self.realtime_model_name(), device="cuda",
+            compute_type=self.compute_type_combo.currentText(),
+            auto_language=self.language_combo.currentText() == "auto")
+
+    def stt_config(self):
+        """识别配置（所有音源共用）"""
+        config = {
+            'language': "" if self.language_combo.currentText() == "auto" else self.language_combo.currentText(),
+            'model': self.model_combo.currentText(),
+            'device': "cuda",  # 确保使用显卡
+            'silero_sensitivity': self.silero_sensitivity.value(),
+            'silero_use_onnx': self.silero_onnx.isChecked(),
+            'enable_realtime_transcription': True,  # 启用实时转录
+            "webrtc_sensitivity":3,
+            "post_speech_silence_duration":0.4, 
+            "min_length_of_recording":0.3, 
+            "realtime_processing_pause" : 0.01, 
+            "realtime_model_type" : self.realtime_model_name(),
+            'backend': self.backend_combo.currentData(),
+        }
+        
+        # 添加唤醒词配置
+        if self.enable_wake_word.isChecked():
+            config.update({
+                'wake_words': self.wake_word_combo.currentText(),
+                'wake_words_sensitivity': 0.5
+            })
+        return config
+
+    def source_config(self, config, source_id):
+        """为某个音源接入共享推理池"""
+        source_config = dict(config)
+        if self.inference_pool:
+            source_config.update({
+                'transcription_executor': self.inference_pool.executor(source_id, 'main'),
+                'realtime_transcription_executor': self.inference_pool.executor(source_id, 'realtime'),
+            })
+        return source_config
+
     def load_model(self):
         if not self.model_loaded:
-            config = {
-                'language': self.language_combo.currentText(),
-                'model': self.model_combo.currentText(),
-                'device': "cuda",  # 确保使用显卡
-                'silero_sensitivity': self.silero_sensitivity.value(),
-                'silero_use_onnx': self.silero_onnx.isChecked(),
-                'input_device_index': int(self.mic_combo.currentText().split(':')[0]),
-                'enable_realtime_transcription': True,  # 启用实时转录
-                "webrtc_sensitivity":3,
-                "post_speech_silence_duration":0.4, 
-                "min_length_of_recording":0.3, 
-                "realtime_processing_pause" : 0.01, 
-                "realtime_model_type" : "tiny"
-            }
-            
-            # 添加唤醒词配置
-            if self.enable_wake_word.isChecked():
-                config.update({
-                    'wake_words': self.wake_word_combo.currentText(),
-                    'wake_words_sensitivity': 0.5
-                })
-            
-            self.stt_thread = STTThread(config)
-            self.stt_thread.text_signal.connect(self.update_subtitle)
-            self.stt_thread.model_ready_signal.connect(self.on_model_ready)
-            
-            # 更新按钮文本并禁用相关控件
-            self.load_model_button.setText("加载中...")
-            self.load_model_button.setEnabled(False)
-            
-            # 禁用所有设置控件
-            self.mic_combo.setEnabled(False)
-            self.language_combo.setEnabled(False)
-            self.model_combo.setEnabled(False)
-            self.wake_word_combo.setEnabled(False)
-            self.enable_wake_word.setEnabled(False)
-            self.silero_sensitivity.setEnabled(False)
-            self.silero_onnx.setEnabled(False)
-            
-            # 启动加载超时计时器 (60秒)
-            self.loading_timer.start(360000)
-            
-            self.stt_thread.start()
-            # 启动翻译线程
-            self.start_translation_thread()
+            sources = self.selected_sources()
+            # 所有音源共享同一份模型，由推理池轮询调度
+            self.inference_pool = self.create_inference_pool()
+            config = self.stt_config()
+            threads = []
+            for source_id, (device_index, _) in enumerate(sources):
+                source_config = self.source_config(config, source_id)
+                source_config['input_device_index'] = device_index
+                threads.append(STTThread(source_config, source_id, self.inference_pool))
+            self.start_stt_threads([name for _, name in sources], threads)
+
+    def load_replay(self):
+        """回放录制的会话：重放识别事件，或把录制的音频重新送去识别"""
+        if self.model_loaded or self.stt_threads:
+            return
+        directory = QFileDialog.getExistingDirectory(self, "选择录制的会话", "recordings")
+        if not directory:
+            return
+        try:
+            replay = SessionReplay(directory)
+        except (OSError, ValueError, KeyError) as e:
+            QMessageBox.critical(self, "错误", f"无法读取会话: {e}")
+            return
+        feed_audio = QMessageBox.question(
+            self, "回放会话", "是否重新识别录制的音频？\n选择“否”则直接重放录制的识别结果。"
+        ) == QMessageBox.StandardButton.Yes
+        if feed_audio:
+            self.inference_pool = self.create_inference_pool()
+        clock = ReplayClock(replay.meta.get('start_time', 0))
+        config = self.stt_config()
+        threads = [ReplayThread(self.source_config(config, source_id), source_id, replay, clock,
+                                feed_audio, self.inference_pool)
+                   for source_id in range(len(replay.track_names))]
+        self.start_stt_threads(replay.track_names, threads, clock)
+
+    def start_stt_threads(self, track_names, threads, clock=None):
+        """启动识别线程（实时音源或回放）并进入加载状态"""
+        self.track_names = list(track_names)
+        self.track_texts = {}
+        self.ready_count = 0
+        self.replay_clock = clock
+        # 回放的内容已经在历史记录里，不再重复写入
+        self.transcript_session = None
+        if self.transcript_store and clock is None:
+            self.transcript_session = self.transcript_store.start_session(self.track_names)
+        self.subtitle_window.set_tracks(self.track_names)
+        for thread in threads:
+            thread.text_signal.connect(self.update_subtitle)
+            thread.final_signal.connect(self.on_final_text)
+            thread.model_ready_signal.connect(self.on_model_ready)
+            thread.error_signal.connect(lambda *_: self.supervise())
+        self.stt_threads = list(threads)
+        
+        # 更新按钮文本并禁用相关控件
+        self.load_model_button.setText("加载中...")
+        self.load_model_button.setEnabled(False)
+        
+        # 禁用所有设置控件
+        self.mic_combo.setEnabled(False)
+        self.source_list.setEnabled(False)
+        self.language_combo.setEnabled(False)
+        self.model_combo.setEnabled(False)
+        self.realtime_model_combo.setEnabled(False)
+        self.compute_type_combo.setEnabled(False)
+        self.backend_combo.setEnabled(False)
+        self.wake_word_combo.setEnabled(False)
+        self.enable_wake_word.setEnabled(False)
+        self.silero_sensitivity.setEnabled(False)
+        self.silero_onnx.setEnabled(False)
+        
+        # 启动加载超时计时器 (60秒)
+        self.loading_timer.start(360000)
+        
+        for thread in self.stt_threads:
+            thread.start()
+        # 启动翻译线程
+        self.start_translation_thread(clock)
 
     def handle_loading_timeout(self):
         """处理模型加载超时"""
         if not self.model_loaded:
             # 停止加载
-            if self.stt_thread:
-                self.stt_thread.stop()
-                self.stt_thread = None
+            self.stop_stt_threads()
             
             # 恢复界面状态
             self.load_model_button.setText("加载模型")
             self.load_model_button.setEnabled(True)
             self.mic_combo.setEnabled(True)
+            self.source_list.setEnabled(True)
             self.language_combo.setEnabled(True)
             self.model_combo.setEnabled(True)
+            self.realtime_model_combo.setEnabled(True)
+            self.compute_type_combo.setEnabled(True)
+            self.backend_combo.setEnabled(True)
             self.wake_word_combo.setEnabled(True)
             self.enable_wake_word.setEnabled(True)
             self.silero_sensitivity.setEnabled(True)
@@ -965,6 +3980,10 @@ class MainWindow(QMainWindow):
             QMessageBox.critical(self, "错误", "模型加载超时(60s)，请重试")
 
     def on_model_ready(self):
+        # 等待所有音源的录音器就绪
+        self.ready_count += 1
+        if self.ready_count < len(self.stt_threads):
+            return
         # 停止超时计时器
         self.loading_timer.stop()
         self.model_loaded = True
@@ -973,16 +3992,29 @@ class MainWindow(QMainWindow):
         self.start_button.setEnabled(True)
 
     def unload_model(self):
-        if self.stt_thread and self.stt_thread.recorder:
-            self.stt_thread.recorder.shutdown()  # 使用 shutdown() 方法
-            self.stt_thread = None
+        if self.stt_threads and self.model_loaded:
+            for thread in self.stt_threads:
+                thread.running = False
+                if thread.recorder:  # 回放识别事件时没有录音器
+                    thread.recorder.shutdown()  # 使用 shutdown() 方法
+            self.stt_threads = []
+            self.replay_clock = None
+            # 下次加载（实时或回放）用新的翻译线程和对应的时钟
+            self.stop_translation_thread()
+            if self.inference_pool:
+                self.inference_pool.shutdown()
+                self.inference_pool = None
             self.is_recording = False
             self.model_loaded = False
             
             # 启用所有设置控件
             self.mic_combo.setEnabled(True)
+            self.source_list.setEnabled(True)
             self.language_combo.setEnabled(True)
             self.model_combo.setEnabled(True)
+            self.realtime_model_combo.setEnabled(True)
+            self.compute_type_combo.setEnabled(True)
+            self.backend_combo.setEnabled(True)
             self.wake_word_combo.setEnabled(True)
             self.enable_wake_word.setEnabled(True)
             self.silero_sensitivity.setEnabled(True)
@@ -998,20 +4030,461 @@ class MainWindow(QMainWindow):
         """启用/禁用唤醒词"""
         self.wake_word_combo.setEnabled(enabled)
 
-    def update_subtitle(self, text):
+    def update_subtitle(self, track):
+        text = self.stt_threads[track].take_text() if track < len(self.stt_threads) else None
+        if text is None:
+            return
         if not self.enable_translate.isChecked():
-            # 更新主窗口的输出文本
-            self.output_text.setText(text)
-            # 如果字幕窗口可见，也更新字幕
-            if self.subtitle_visible:
-                self.subtitle_window.update_text(text)
+            self.show_track_text(track, text)
         else:
             # 将文本加入翻译队列
-            self.translation_thread.add_text(text)
+            self.translation_thread.add_text(text, track, self.segment_ids.get(track, 0),
+                                             self.source_language(track))
+        self.publish('partial', track, text)
 
             
 
+def benchmark_models(models, device="cpu"):
+    """报告每种模型配置的常驻内存，每种配置在独立子进程中加载"""
+    print(f"{'main':<12}{'realtime':<12}{'compute':<10}{'RSS (MB)':>10}")
+    for model in models:
+        for compute_type in ("int8", "float32"):
+            for realtime_model in dict.fromkeys(("tiny", model)):  # 主模型就是 tiny 时只测一次
+                result = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), '--benchmark-one',
+                     model, realtime_model, device, compute_type],
+                    capture_output=True, text=True)
+                rss = result.stdout.strip().splitlines()[-1] if result.returncode == 0 else "error"
+                print(f"{model:<12}{realtime_model:<12}{compute_type:<10}{rss:>10}")
+
+def benchmark_one(model, realtime_model, device, compute_type):
+    baseline = resident_memory_mb()
+    pool = SharedInferencePool(model, realtime_model, device=device, compute_type=compute_type, workers=1)
+    pool.load()
+    print(f"{resident_memory_mb() - baseline:.0f}")
+    pool.shutdown()
+
+def benchmark_linebreak(updates=3000, width=900, font_size=28):
+    """模拟 30 Hz 的实时转录更新，比较增量断行和每次完整断行的耗时
+
+    先检查增量断行与完整断行的结果一致（包括识别结果回改的情况），不一致时返回 1。
+    """
+    app = QApplication.instance() or QApplication(sys.argv)
+    font = QFont(app.font())
+    font.setPixelSize(font_size)
+
+    def mismatches(breaker, sequence, max_width):
+        state, count = None, 0
+        for text in sequence:
+            state = breaker.layout(text, max_width, state)
+            count += state != breaker.layout(text, max_width)
+        return count
+
+    breaker = LineBreaker(font)
+    # 第二行只放得下 "c" 的宽度：回改成更短的文本后整段应能放进一行
+    narrow = sum(breaker.char_width(c) for c in "aaaa bbbb cc")
+    failed = mismatches(breaker, ["aaaa bbbb cccccc", "aaaa bbbb c"], narrow)
+    texts = {
+        'zh': "今天我们来讨论一下实时字幕系统的延迟问题，包括语音识别、翻译和显示三个部分。" * 3,
+        'en': "Today we are going to talk about latency in a realtime subtitle pipeline, "
+              "covering recognition, translation and rendering. " * 3,
+        'mixed': "我们用 faster-whisper 做识别，然后交给 Ollama 翻译（大约 200ms），最后显示在 OBS 里。" * 3,
+    }
+    for text in texts.values():
+        # 只增长，以及每隔几次把末尾几个字改掉（识别结果回改）
+        growing = [text[:n] for n in range(1, len(text) + 1)]
+        revised = [text[:n] if n % 7 else text[:max(n - 5, 1)] + text[n - 1]
+                   for n in range(1, len(text) + 1)]
+        for max_width in (width, width / 3):
+            failed += mismatches(breaker, growing, max_width) + mismatches(breaker, revised, max_width)
+    print(f"incremental layout matches full layout: {'ok' if not failed else f'FAIL ({failed} mismatches)'}")
+
+    print(f"{'text':<8}{'incremental (us)':>18}{'p99 (us)':>10}{'full (us)':>12}")
+    for name, text in texts.items():
+        # 每次更新多出 1~3 个字符，和实时转录的增长方式一样
+        partials = [text[:n] for n in range(1, len(text) + 1, 2)]
+        partials = (partials * (updates // len(partials) + 1))[:updates]
+        LineBreaker.width_caches.clear()
+        breaker = LineBreaker(font)
+        timings, state = [], None
+        for partial in partials:
+            start = time.perf_counter()
+            state = breaker.layout(partial, width, state)
+            LineBreaker.lines(state)
+            timings.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        for partial in partials:
+            LineBreaker.lines(breaker.layout(partial, width))
+        full = (time.perf_counter() - start) / len(partials)
+        timings.sort()
+        print(f"{name:<8}{sum(timings) / len(timings) * 1e6:>18.1f}"
+              f"{timings[int(len(timings) * 0.99)] * 1e6:>10.1f}{full * 1e6:>12.1f}")
+    return 1 if failed else 0
+
+def load_test(sources=2, seconds=10.0, rate=1000.0, clients=400, port=8799):
+    """用模拟后端压测 识别 → 界面合并 → 翻译调度 → 广播，不需要模型、音频设备和 Ollama
+
+    先不连广播客户端跑一遍，再连 clients 个 SSE 客户端跑一遍，比较本地字幕的延迟
+    和界面更新吞吐。延迟是界面线程取到的文本的年龄（识别后端发出它到被取走），
+    界面跟不上、中间的更新被合并掉时也照样计入。
+    """
+    app = QCoreApplication.instance() or QCoreApplication(sys.argv)
+
+    class TimedSTTThread(STTThread):
+        def __init__(self, *args):
+            super().__init__(*args)
+            self.emitted_at = {}  # 文本 -> 发出时间，只保留最近的
+
+        def process_text(self, text):
+            if text != self.last_text:
+                self.emitted_at[text] = time.perf_counter()
+                if len(self.emitted_at) > 1024:
+                    del self.emitted_at[next(iter(self.emitted_at))]
+            super().process_text(text)
+
+    def run(clients):
+        config = {'backend': MockTranscriber.name, 'mock_partial_rate': rate, 'mock_pause': 0}
+        threads = [TimedSTTThread(config, source_id) for source_id in range(sources)]
+        translator = TranslateThread(GlossaryTranslator(Glossary()), "zh")
+        server = SubtitleBroadcastServer(host='127.0.0.1', port=port)
+        server.start()
+        counts = {'ui_partial': 0, 'final': 0, 'translation': 0, 'client_bytes': 0}
+        latencies = []
+        segments = {}
+        reading = Event()
+        reading.set()
+
+        def on_text(track):
+            text = threads[track].take_text()
+            if text is None:
+                return
+            emitted = threads[track].emitted_at.get(text)
+            if emitted is not None:
+                latencies.append(time.perf_counter() - emitted)
+            counts['ui_partial'] += 1
+            translator.add_text(text, track, segments.get(track, 0))
+            server.publish('partial', track, text)
+
+        def on_final(track, text):
+            counts['final'] += 1
+            segment = segments.get(track, 0)
+            segments[track] = segment + 1
+            translator.add_final(text, track, segment)
+            server.publish('final', track, text)
+
+        def on_translation(track):
+            text = translator.take_translation(track)
+            if text is not None:
+                counts['translation'] += 1
+                server.publish('translation', track, text)
+
+        def read_events():
+            # 所有 SSE 客户端由一个线程用 selectors 读取，客户端多也不会占满 GIL
+            selector = selectors.DefaultSelector()
+            for _ in range(clients):
+                try:
+                    sock = socket.create_connection(('127.0.0.1', port))
+                except OSError as e:
+                    print(f"client connect failed: {e}")
+                    break
+                sock.sendall(b"GET /events HTTP/1.1\r\nHost: localhost\r\n\r\n")
+                sock.setblocking(False)
+                selector.register(sock, selectors.EVENT_READ)
+            while reading.is_set():
+                for key, _ in selector.select(timeout=0.1):
+                    try:
+                        data = key.fileobj.recv(65536)
+                    except OSError:
+                        data = b""
+                    if not data:
+                        selector.unregister(key.fileobj)
+                        key.fileobj.close()
+                        continue
+                    counts['client_bytes'] += len(data)
+            for key in list(selector.get_map().values()):
+                key.fileobj.close()
+
+        reader = Thread(target=read_events, daemon=True)
+        if clients:
+            reader.start()
+            deadline = time.time() + 10
+            while server.stats()['clients'] < clients and time.time() < deadline:
+                time.sleep(0.1)  # 等客户端都连上
+        connected = server.stats()['clients']
+        translator.translation_signal.connect(on_translation)
+        translator.start()
+        for thread in threads:
+            thread.text_signal.connect(on_text)
+            thread.final_signal.connect(on_final)
+            thread.model_ready_signal.connect(thread.resume)
+            thread.start()
+        QTimer.singleShot(int(seconds * 1000), app.quit)
+        app.exec()
+
+        generated = {'partial': 0, 'final': 0}
+        for thread in threads:
+            for kind in generated:
+                generated[kind] += thread.recorder.emitted[kind] if thread.recorder else 0
+            thread.running = False
+            if thread.recorder:
+                thread.recorder.shutdown()
+            thread.wait(2000)
+        translator.stop()
+        broadcast = server.stats()
+        reading.clear()
+        if clients:
+            reader.join(2)
+        server.stop()
+        latencies.sort()
+
+        print(f"\n{sources} sources x {rate:.0f} partials/s for {seconds:.0f}s, {connected} broadcast clients")
+        print(f"generated: {generated['partial']} partials ({generated['partial'] / seconds:.0f}/s), "
+              f"{generated['final']} finals")
+        print(f"UI: {counts['ui_partial']} partial updates ({counts['ui_partial'] / seconds:.0f}/s, "
+              f"rest coalesced), {counts['final']} finals, {counts['translation']} translations")
+        for stat in [thread.outbox.stats() for thread in threads] + translator.queue_stats():
+            print(f"  {stat['name']:<16}{stat['policy']:<12}high water {stat.get('high_water', '-')}  "
+                  f"dropped {stat['dropped']}")
+        print(f"broadcast: {broadcast['clients']} clients, {broadcast['evicted']} evicted, "
+              f"{counts['client_bytes'] / 1024:.0f} KB received")
+        if not latencies:
+            return None
+        result = (latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000,
+                  counts['ui_partial'] / seconds)
+        print(f"local subtitle latency: p50 {result[0]:.2f}ms  p99 {result[1]:.2f}ms "
+              f"({len(latencies)} samples)")
+        return result
+
+    baseline = run(0)
+    loaded = run(clients) if clients else None
+    if baseline and loaded:
+        print(f"\nwithout / with {clients} clients: "
+              f"local subtitle latency p50 {baseline[0]:.2f} / {loaded[0]:.2f}ms  "
+              f"p99 {baseline[1]:.2f} / {loaded[1]:.2f}ms  "
+              f"UI updates {baseline[2]:.0f} / {loaded[2]:.0f}/s")
+
+def stress_test(seconds=12.0, stall=4.0, rate=200.0):
+    """模拟后端卡死：翻译和推理在前 stall 秒每个请求都卡住，检查队列始终有界、
+    过时数据被丢弃，并且卡顿结束后延迟恢复。任何检查失败时返回非零退出码。"""
+    app = QCoreApplication.instance() or QCoreApplication(sys.argv)
+    start = time.time()
+    stall_until = start + stall
+    failures = []
+
+    def check(ok, message):
+        print(f"{'ok  ' if ok else 'FAIL'} {message}")
+        if not ok:
+            failures.append(message)
+
+    def stalled_call():
+        """卡顿期间卡住直到卡顿结束，之后正常耗时 20ms"""
+        time.sleep(max(0.0, stall_until - time.time()) or 0.02)
+
+    class StalledTranslator(Translator):
+        name = "stalled"
+
+        def translate(self, text, target_lang, on_partial=None, should_stop=None):
+            while time.time() < stall_until:
+                if should_stop and should_stop():
+                    raise TranslationCancelled()
+                time.sleep(0.05)
+            time.sleep(0.02)
+            return f"T:{text}"
+
+    # 翻译：模拟识别源 → 界面合并 → 翻译调度
+    config = {'backend': MockTranscriber.name, 'mock_partial_rate': rate, 'mock_pause': 0.2}
+    threads = [STTThread(config, source_id) for source_id in range(2)]
+    translator = TranslateThread(StalledTranslator(), "zh")
+    translator.translation_threshold = 0.1
+    added = {}  # 原文 -> 送去翻译的时间
+    latencies = []  # (发布时间, 延迟)
+    segments = {}
+    finals = {}  # (track, segment) -> 送去翻译的时间
+    translated_finals = set()
+
+    def on_text(track):
+        text = threads[track].take_text()
+        if text is not None:
+            added[text] = time.time()
+            translator.add_text(text, track, segments.get(track, 0))
+
+    def on_final(track, text):
+        segment = segments.get(track, 0)
+        segments[track] = segment + 1
+        added[text] = time.time()
+        finals[(track, segment)] = time.time()
+        translator.add_final(text, track, segment)
+
+    def on_final_translation(track, segment, text):
+        translated_finals.add((track, segment))
+
+    def on_translation(track):
+        text = translator.take_translation(track)
+        if text and text.startswith("T:") and text[2:] in added:
+            latencies.append((time.time(), time.time() - added[text[2:]]))
+
+    # 推理池：每个音源不停提交实时转录，每秒一次最终转录，提交方不等待结果
+    @dataclasses.dataclass
+    class EngineConfig:
+        beam_size: int = 5
+
+    class StalledEngine:
+        config = EngineConfig()
+
+        def transcribe(self, audio, **kwargs):
+            stalled_call()
+            return audio
+
+    class StalledRegistry:
+        def acquire(self, model, device, compute_type='auto'):
+            return model, StalledEngine()
+
+        def release(self, key):
+            pass
+
+    pool = SharedInferencePool("stalled", "stalled", device="cpu", registry=StalledRegistry())
+    pool.load()
+    inference = {'realtime': [], 'main': [], 'cancelled': 0, 'max_depth': 0}
+
+    def submit(source_id, role):
+        submitted = time.time()
+        future = pool.submit(source_id, role, role)
+
+        def done(f):
+            if f.cancelled():
+                inference['cancelled'] += 1
+            else:
+                inference[role].append((time.time(), time.time() - submitted))
+        future.add_done_callback(done)
+
+    def produce(source_id):
+        tick = 0
+        while time.time() - start < seconds:
+            submit(source_id, 'main' if tick % 50 == 0 else 'realtime')
+            tick += 1
+            time.sleep(0.02)
+
+    # 每 20ms 采样一次各级队列深度
+    depth_violations = []
+
+    def sample():
+        for stat in [t.outbox.stats() for t in threads] + translator.queue_stats() + [pool.stats()]:
+            if stat['depth'] > stat['maxsize'] + stat.get('pinned', 0):
+                depth_violations.append(stat)
+        inference['max_depth'] = max([inference['max_depth']] + [len(q) for q in list(pool.pending.values())])
+
+    sampler = QTimer()
+    sampler.timeout.connect(sample)
+    sampler.start(20)
+    translator.translation_signal.connect(on_translation)
+    translator.final_translation_signal.connect(on_final_translation)
+    translator.start()
+    for thread in threads:
+        thread.text_signal.connect(on_text)
+        thread.final_signal.connect(on_final)
+        thread.model_ready_signal.connect(thread.resume)
+        thread.start()
+    for source_id in range(2):
+        Thread(target=produce, args=(source_id,), daemon=True).start()
+    QTimer.singleShot(int(seconds * 1000), app.quit)
+    app.exec()
+    sampler.stop()
+    for thread in threads:
+        thread.running = False
+        if thread.recorder:
+            thread.recorder.shutdown()
+        thread.wait(2000)
+    translator.stop()
+    pool.shutdown()
+
+    print(f"stall {stall:.0f}s of {seconds:.0f}s, {rate:.0f} partials/s per source")
+    stats = {stat['name']: stat for stat in translator.queue_stats()}
+    check(not depth_violations, f"queues stayed within maxsize ({len(depth_violations)} violations)")
+    end = start + seconds
+    expected = [key for key, added_at in finals.items() if added_at < end - 1.0]
+    missing = [key for key in expected if key not in translated_finals]
+    check(bool(expected) and not missing,
+          f"every final was translated despite the backlog ({len(expected) - len(missing)}/{len(expected)})")
+    check(stats['translate']['dropped'] > 0,
+          f"stale partials dropped during the stall (translate dropped {stats['translate']['dropped']})")
+    check(inference['max_depth'] <= pool.max_pending,
+          f"inference backlog per source ≤ {pool.max_pending} (max {inference['max_depth']})")
+    check(pool.dropped > 0, f"stale realtime requests dropped during the stall ({pool.dropped})")
+    recovered = [latency for when, latency in latencies if when > stall_until + 2.0]
+    check(bool(recovered) and max(recovered) < 1.0,
+          f"translation latency recovered after the stall (max {max(recovered, default=float('nan')):.2f}s "
+          f"over {len(recovered)} updates, 2s after it ended)")
+    recovered = [latency for when, latency in inference['realtime'] if when > stall_until + 1.0]
+    check(bool(recovered) and max(recovered) < 0.5,
+          f"inference latency recovered after the stall (max {max(recovered, default=float('nan')):.2f}s)")
+    return 1 if failures else 0
+
+def replay_headless(directory, glossary_path=None, target_lang="zh"):
+    """无界面回放：按录制的时间戳逐条送入翻译线程，结果打印到标准输出
+
+    使用 SteppedClock 并在当前线程里直接调用 TranslateThread.step()，
+    不依赖真实时间和线程调度，同一份录制每次运行的输出完全相同。
+    翻译使用术语表（不联网、结果确定），只重放识别事件，不重新识别音频。
+    """
+    replay = SessionReplay(directory)
+    names = replay.track_names
+    start = replay.meta.get('start_time', 0)
+    clock = SteppedClock(start)
+    glossary = Glossary(glossary_path)
+    translator = TranslateThread(GlossaryTranslator(glossary), target_lang, glossary, clock=clock)
+    segment_ids = {}
+    seconds = 0.0
+
+    def emit(kind, track, text):
+        print(f"{seconds:9.3f} [{names[track]}] {kind}: {text}")
+
+    translator.final_translation_signal.connect(
+        lambda track, segment, text: emit(f"final translation #{segment}", track, text))
+
+    for seconds, kind, track, text in replay.iter_events(kinds=('partial', 'final')):
+        clock.sleep_until(start + seconds)
+        segment = segment_ids.get(track, 0)
+        emit(kind, track, text)
+        if kind == 'partial':
+            translator.add_text(text, track, segment)
+        else:
+            segment_ids[track] = segment + 1
+            translator.add_final(text, track, segment)
+        while True:
+            try:
+                translator.step(timeout=0)
+            except Empty:
+                break
+        for out_track in range(len(names)):
+            translation = translator.take_translation(out_track)
+            if translation is not None:
+                emit("translation", out_track, translation)
+
 if __name__ == '__main__':
+    # python STTgui.py --benchmark-models [模型 ...]  报告各配置的常驻内存
+    if len(sys.argv) > 1 and sys.argv[1] == '--benchmark-models':
+        benchmark_models(sys.argv[2:] or ["tiny", "base", "small"])
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == '--benchmark-one':
+        benchmark_one(*sys.argv[2:6])
+        sys.exit(0)
+    # python STTgui.py --benchmark-linebreak  字幕断行在 30 Hz 更新下的耗时
+    if len(sys.argv) > 1 and sys.argv[1] == '--benchmark-linebreak':
+        sys.exit(benchmark_linebreak())
+    # python STTgui.py --stress-test [秒数 卡顿秒数]  模拟翻译/推理卡死，检查队列有界和延迟恢复
+    if len(sys.argv) > 1 and sys.argv[1] == '--stress-test':
+        sys.exit(stress_test(*[float(a) for a in sys.argv[2:4]]))
+    # python STTgui.py --replay <录制目录> [术语表文件]  无界面回放，输出可重复
+    if len(sys.argv) > 2 and sys.argv[1] == '--replay':
+        replay_headless(*sys.argv[2:4])
+        sys.exit(0)
+    # python STTgui.py --load-test [音源数 秒数 每秒实时转录数 广播客户端数]  用模拟后端压测
+    if len(sys.argv) > 1 and sys.argv[1] == '--load-test':
+        args = sys.argv[2:6]
+        load_test(*[int(args[0])] if args else [], *[float(a) for a in args[1:3]],
+                  *[int(a) for a in args[3:4]])
+        sys.exit(0)
+
     app = QApplication(sys.argv)
     app.setStyle('Fusion')
     